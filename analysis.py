@@ -37,7 +37,7 @@ def get_laplacian(image_grey):
 	assert len(image_grey.shape) < 3
 	
 	# Approximation kernel
-	kernel = np.array([[0,1,0], [1,-4,1], [0,1,0]])
+	kernel = fil.laplacian_kernel()
 	
 	# Retrn convoluted image 
 	return fil.image_conv(image_grey, kernel)
@@ -63,20 +63,27 @@ def get_err(grey_image):
 	# Return tau = E_f/|f(0)|^2
 	return E_f/np.power(np.abs(f0), 2) 
 
-def get_rect(grey_image):
+def get_rect(grey_image, fast=False, size=256):
 	"""
 	This function will return the bounding rectangle 
 	coordinates. It uses canny edge detection to identify
 	the important edges, then a simple where search to 
 	find the min and maxima points where the edges occur.
+	The fast mode finds the fundus field on a thumbnail
+	instead (see field_rect), which is much cheaper on
+	large images.
 
 	Args:
 		gre_image - np array representing the image data.
+		fast - bool, use field_rect instead of the edges.
+		size - int, longest side of the fast mode thumbnail.
 
 	Returns:
 		(x1, y1, x2, y2) tuple representing the diagonal 
 		vertices f the bounding rectangle.
 	"""
+	if fast:
+		return field_rect(grey_image, size)
 
 	# Pre filter to remove the noise in black areas
 	gaussian_n = np.round(np.max(grey_image.shape)*0.004) # Gaussian size
@@ -98,6 +105,210 @@ def get_rect(grey_image):
 	# Simply return out tuple of coords now
 	return (np.min(cols), np.min(rows), np.max(cols), np.max(rows))
 
+
+def _brightest_channel(image):
+	"""
+	Returns the brightest channel of each pixel of a colour
+	image (the image itself when grey). Same as the max over
+	the last axis, which numpy reduces very slowly.
+	"""
+	if image.ndim < 3:
+		return image
+	brightest = image[..., 0]
+	for channel in range(1, image.shape[2]):
+		brightest = np.maximum(brightest, image[..., channel])
+	return brightest
+
+
+def surround_level(thumbnail, corner=8):
+	"""
+	Returns the intensity of the surround of the fundus field,
+	the 90th percentile of the corner patches (it is never
+	quite black).
+	"""
+	c = corner
+	corners = np.concatenate([thumbnail[:c, :c].ravel(), thumbnail[:c, -c:].ravel(),
+							  thumbnail[-c:, :c].ravel(), thumbnail[-c:, -c:].ravel()])
+	return np.percentile(corners, 90)
+
+
+def field_threshold(thumbnail, fraction=0.08, corner=8):
+	"""
+	Returns the intensity separating the fundus field from
+	the surround, fraction of the way from the surround level
+	(see surround_level) to the brightest pixels (99th
+	percentile).
+	"""
+	dark, bright = surround_level(thumbnail, corner), np.percentile(thumbnail, 99)
+	return dark + fraction*(bright - dark)
+
+
+def fit_circle(points):
+	"""
+	Returns the (cx, cy, r, rms) of the least squares circle
+	through the (x, y) points (algebraic fit), where rms is
+	the RMS distance of the points to the circle.
+	"""
+	x, y = points[:, 0].astype(np.float64), points[:, 1].astype(np.float64)
+	A = np.column_stack([x, y, np.ones(len(x))])
+	(a, b, c), _, _, _ = np.linalg.lstsq(A, x*x + y*y, rcond=None)
+	cx, cy = a/2, b/2
+	r = np.sqrt(max(c + cx*cx + cy*cy, 0.0))
+	rms = np.sqrt(np.mean((np.hypot(x - cx, y - cy) - r)**2))
+	return cx, cy, r, rms
+
+
+def _circle_box(blob, thumbnail, box, slope, reach=3, margin=2, min_points=20, max_rms=2.0):
+	"""
+	Returns the box of the blob (x1, y1, x2, y2, exclusive) with
+	its dim sides moved to the circle of the field. A side is
+	dim when most of the outline along it is on a gentle slope
+	(under slope grey levels per pixel within reach), i.e. the
+	field fades out there (vignetting) and was cut by the
+	threshold, the field edges and the flat cuts of the camera
+	mask are steps. The circle is fitted to the steep outline,
+	without the points along the sides of the box (the flat
+	cuts) or on the image border. The box is kept when the
+	outline is not a circle (too few points or a rms over
+	max_rms, e.g. elliptical fields).
+	"""
+	x1, y1, x2, y2 = box
+	height, width = blob.shape
+	contours, _ = cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+	points = max(contours, key=len)[:, 0, :]
+	xs, ys = points[:, 0], points[:, 1]
+
+	# Steepest slope (grey levels per pixel) around each point
+	grey = np.float32(thumbnail)
+	gradient = cv2.magnitude(cv2.Sobel(grey, cv2.CV_32F, 1, 0), cv2.Sobel(grey, cv2.CV_32F, 0, 1))/8
+	gradient = cv2.dilate(gradient, np.ones((2*reach + 1, 2*reach + 1), np.uint8))
+	steep = gradient[ys, xs] >= slope
+
+	# Outline along each side (left, top, right, bottom)
+	along = [xs < x1 + margin, ys < y1 + margin, xs >= x2 - margin, ys >= y2 - margin]
+	dim = [np.any(side) and np.mean(steep[side]) < 0.5 for side in along]
+	if not any(dim):
+		return box
+
+	inner = ~np.any(along, axis=0) & (xs > 0) & (ys > 0) & (xs < width - 1) & (ys < height - 1)
+	if np.count_nonzero(inner & steep) < min_points:
+		return box
+	# Refitted without the points off the first circle (where
+	# the outline starts to run into the dim sides)
+	fitted = points[inner & steep]
+	cx, cy, r, rms = fit_circle(fitted)
+	on_circle = np.abs(np.hypot(fitted[:, 0] - cx, fitted[:, 1] - cy) - r) <= max_rms
+	if np.count_nonzero(on_circle) >= min_points:
+		cx, cy, r, rms = fit_circle(fitted[on_circle])
+	if rms > max_rms:
+		return box
+
+	circle = [max(int(np.floor(cx - r)), 0), max(int(np.floor(cy - r)), 0),
+			  min(int(np.ceil(cx + r)), width), min(int(np.ceil(cy + r)), height)]
+	return (min(x1, circle[0]) if dim[0] else x1, min(y1, circle[1]) if dim[1] else y1,
+			max(x2, circle[2]) if dim[2] else x2, max(y2, circle[3]) if dim[3] else y2)
+
+
+def _edge_crossing(profile, threshold, reverse=False):
+	"""
+	Returns the (sub-pixel) position where the profile first
+	reaches the threshold (last one when reverse), linearly
+	interpolated between the two pixels around it, or None
+	if it never does.
+	"""
+	above = np.nonzero(profile >= threshold)[0]
+	if not len(above):
+		return None
+	i = above[-1] if reverse else above[0]
+	j = i + 1 if reverse else i - 1 # Neighbour outside the field
+	if not 0 <= j < len(profile):
+		return float(i)
+	return i + (j - i)*(profile[i] - threshold)/(profile[i] - profile[j])
+
+
+def field_rect(image, size=256, fraction=0.08, max_lines=512):
+	"""
+	This function will return the bounding rectangle of the
+	fundus field, like get_rect, but without touching most
+	of the image. The field is thresholded (see
+	field_threshold) on a thumbnail, its largest blob gives
+	the coarse box and each side is then refined on a thin
+	strip of the full image around it, where the profile of
+	the brightest pixels (across the side) crosses the
+	threshold with sub-pixel precision.
+
+	Args:
+		image - np array with the grey or colour (any order)
+			image, the brightest channel is used.
+		size - int, longest side of the thumbnail.
+		fraction - float, see field_threshold.
+		max_lines - int, max number of lines (rows or columns)
+			of each strip used for the profile.
+
+	Returns:
+		(x1, y1, x2, y2) tuple with the bounding rectangle, the
+		whole image when there is no dark surround.
+	"""
+	height, width = image.shape[0:2]
+	scale = max(height, width)/size
+	thumbnail = image
+	if scale > 1:
+		# Sampled at twice the size first, averaging all the
+		# pixels would cost more than the rest put together
+		thumb_size = (max(int(round(width/scale)), 1), max(int(round(height/scale)), 1))
+		thumbnail = cv2.resize(image, (2*thumb_size[0], 2*thumb_size[1]), interpolation=cv2.INTER_NEAREST)
+		thumbnail = cv2.resize(thumbnail, thumb_size, interpolation=cv2.INTER_AREA)
+	thumbnail = cv2.medianBlur(_brightest_channel(thumbnail), 5)
+	scale_y, scale_x = height/thumbnail.shape[0], width/thumbnail.shape[1]
+
+	# Coarse box of the largest bright blob (the opening cuts
+	# the thin bridges to glare and labels in the surround)
+	corner = max(min(thumbnail.shape)//16, 1)
+	threshold = field_threshold(thumbnail, fraction, corner)
+	field = np.uint8(thumbnail > threshold)
+	field = cv2.morphologyEx(field, cv2.MORPH_OPEN, np.ones((5, 5), np.uint8))
+	count, labels, stats, _ = cv2.connectedComponentsWithStats(field, connectivity=8)
+	if count < 2:
+		return (0, 0, width - 1, height - 1)
+	blob = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+	x, y, w, h = stats[blob, 0:4]
+
+	# The dim edges of the field are under the threshold, they
+	# are taken from the circle of the field (see _circle_box),
+	# a gentle slope climbs less than a quarter of the way to
+	# the threshold in one pixel
+	slope = (threshold - surround_level(thumbnail, corner))/4
+	x, y, x_end, y_end = _circle_box(np.uint8(labels == blob), thumbnail, (x, y, x + w, y + h), slope)
+	w, h = x_end - x, y_end - y
+
+	# Refine each side on a strip (one thumbnail pixel either
+	# side of the coarse side) of the full image
+	y1, y2 = int(y*scale_y), min(int(np.ceil((y + h)*scale_y)), height)
+	x1, x2 = int(x*scale_x), min(int(np.ceil((x + w)*scale_x)), width)
+	pad_x, pad_y = int(np.ceil(scale_x)), int(np.ceil(scale_y))
+	step_y, step_x = max((y2 - y1)//max_lines, 1), max((x2 - x1)//max_lines, 1)
+
+	def profile(strip, axis):
+		# Brightest channel, smoothed (JPEG noise), then the
+		# max across the side
+		return np.max(cv2.blur(_brightest_channel(strip), (3, 3)), axis=axis).astype(np.float64)
+
+	sides = []
+	for (coarse, pad, limit, step, reverse, axis) in [(x1, pad_x, width, step_y, False, 0),
+			(y1, pad_y, height, step_x, False, 1), (x2, pad_x, width, step_y, True, 0),
+			(y2, pad_y, height, step_x, True, 1)]:
+		start, end = max(coarse - pad, 0), min(coarse + pad, limit)
+		if axis == 0:
+			strip = image[y1:y2:step, start:end]
+		else:
+			strip = image[start:end, x1:x2:step]
+		crossing = _edge_crossing(profile(strip, axis), threshold, reverse)
+		sides.append(start + crossing if crossing is not None else coarse)
+
+	left, top, right, bottom = sides
+	return (max(int(np.floor(left)), 0), max(int(np.floor(top)), 0),
+			min(int(np.ceil(right)), width - 1), min(int(np.ceil(bottom)), height - 1))
+
 def equalise(grey_image):
 	"""
 	This function will transfrom a grayscale 
@@ -166,56 +377,75 @@ def get_histogram(image):
 	# Now return the stacked results
 	return np.hstack([helper(comp) for comp in components])/n_pixels
 
-def match_histogram(image, hist):
+def histogram_cdf(hist):
+	"""
+	This function will return the cumulative distribution
+	of a histogram (e.g. the model one), normalised to end
+	at 1. It only depends on the histogram, so it can be
+	calculated once for all the images (see match_histogram).
+
+	Args:
+		hist - numpy array representing a histogram.
+
+	Returns:
+		Read only numpy array with the distribution.
+	"""
+	cdf = np.cumsum(np.ravel(hist).astype(np.float64))
+	cdf /= cdf[-1]
+	cdf.flags.writeable = False
+	return cdf
+
+def match_histogram(image, hist, exact=False, cdf=None):
 	"""
 	This funcion will take an image and the 
 	average histogram generated from a dataset
 	and manipulate the image's histogram to that
-	of the average one.
+	of the average one. The two cumulative
+	distributions give a lookup table (applied
+	with cv2.LUT), each intensity goes to the
+	model level at the middle rank of its pixels.
+	The exact mode gives the model counts instead
+	(same as the old pixel by pixel version): the
+	pixels are ranked by intensity (ties in raster
+	order), the first int(count) go to level 0 and
+	so on, the ones left by the rounding are kept.
 
 	Args: 
 		image - numpy array representing the image.
 		hist - numpy array representing a histogram.
+		exact - bool, match the counts exactly.
+		cdf - numpy array with the histogram_cdf of
+			hist, calculated once for many images.
 
 	Returns: 
 		Numpy array representing altered image.
 	"""
+	if exact:
+		# Get the number numper of rows and columns in the image
+		# for calculating how many pixels there are later on..
+		rows, cols = image.shape
+
+		# Number of pixels of each level (normalised histogram)
+		counts = (rows*cols*np.ravel(hist)/np.sum(hist)).astype(int)
+		levels = np.repeat(np.arange(len(counts)), counts)
+
+		# Pixels sorted by intensity (the stable sort keeps the
+		# raster order of the ties), the first ones get the
+		# first levels. Mergesort is stable in every numpy
+		# version ("stable" needs numpy 1.15)
+		order = np.argsort(image, axis=None, kind="mergesort")[:len(levels)]
+		altered = image.copy()
+		altered.ravel()[order] = levels[:len(order)]
+		return altered
+
+	if cdf is None:
+		cdf = histogram_cdf(hist)
+
+	# Middle rank (0 to 1) of the pixels of each intensity, and
+	# the model level at that rank
+	counts = cv2.calcHist([image], [0], None, [256], [0, 256]).ravel()
+	middle = (np.cumsum(counts) - counts/2)/np.sum(counts)
+	lut = np.minimum(np.searchsorted(cdf, middle, side="right"), 255).astype(np.uint8)
 
-
-	# Get the number numper of rows and columns in the image
-	# for calculating how many pixels there are later on..
-	rows, cols = image.shape
-
-	# Normalise the histogram
-	hist = (rows*cols*hist)/np.sum(hist)
-
-	# The next array contains a list of 2D matrices (256), 
-	# containing False and True values representing whether 
-	# or not the current pixel has the corresponding intensity
-	I_array = [image==i for i in range(256)] # 256 = #of intensities
-
-	# In the next few lines the actual final form of I is
-	# obtained using np.where. Note that each row in I
-	# corresponds to an index in the image array.
-	I = [np.where(locs) for locs in I_array]
-	I = np.hstack(I).T # Get the primitive locations
-					 # Note I.shape = (rows*cols, 2)
-
-	# Copy image 
-	altered = image.copy()
-	
-	# For loop doing the transformation
-	counter = 0 # Keep track of current index in I
-	for i in range(256):
-		N = int(hist[i])
-	  
-		# Assign N first pixels to corresponding 
-		# intensity        
-		if N > 0: # Check whether assignments are actually made here
-			altered[np.split(I[counter:counter+N], 2, axis=1)] = i
-			
-		# Update counter so we start from correct place in I 
-		counter += N
-		
 	# Returned the modified image 
-	return altered
+	return cv2.LUT(image, lut)
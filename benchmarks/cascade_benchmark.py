@@ -0,0 +1,121 @@
+""" Cascade Benchmark
+
+This script compares detection.ODCascade with the full
+detector on synthetic fundus images with bright lesions
+(see synthetic.fundus), where the disc position is known.
+It reports how many images each tier resolved, the error
+and time of the cascade against the full detector, and
+how well the confidence tells the right boxes (within
+1.5 disc radii) from the wrong ones.
+
+Usage:
+    cascade_benchmark.py PCA [options]
+
+Arguments:
+    PCA             The path to the PCA file.
+
+Options:
+    --size=<s>      HEIGHTxWIDTH of the synthetic images [default: 600x600].
+    --count=<n>     Number of synthetic images [default: 40].
+    --seed=<n>      Seed of the first image [default: 0].
+    --lesions=<n>   Max number of lesions, image i has i % (n+1) [default: 6].
+    --confidence=<c>
+                    Min confidence of the cheap tiers [default: 0.15].
+    --output=<f>    Save the results to a JSON file.
+"""
+
+import os, sys, time, json, cv2
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import detection as det
+import synthetic
+
+
+def run(images, detector):
+	"""
+	This function will detect the OD in the images.
+
+	Args:
+		images - list of (BGR image, disc) tuples.
+		detector - detection.ODDetector or ODCascade.
+
+	Returns:
+		dict with the times (ms), errors (disc radii), hits
+		(error under 1.5 radii), confidences and tiers.
+	"""
+	stats = {"ms": [], "error_radii": [], "hits": [], "confidence": [], "tier": []}
+	for i, (image, disc) in enumerate(images):
+		cv2.setRNGSeed(i)
+		start = time.perf_counter()
+		detection = detector.detect(image)
+		stats["ms"].append(1000*(time.perf_counter() - start))
+
+		x1, y1, x2, y2 = detection.box
+		dx, dy = disc["centre"]
+		error = np.hypot((x1 + x2)/2 - dx, (y1 + y2)/2 - dy)/disc["radius"]
+		stats["error_radii"].append(float(error))
+		stats["hits"].append(bool(error < 1.5))
+		stats["confidence"].append(detection.confidence)
+		stats["tier"].append(detection.tier)
+	return stats
+
+
+def auc(scores, labels):
+	"""
+	Returns the area under the ROC curve of the scores for
+	the boolean labels (None without both labels).
+	"""
+	scores, labels = np.array(scores), np.array(labels)
+	positive, negative = scores[labels], scores[~labels]
+	if not len(positive) or not len(negative):
+		return None
+	greater = np.sum(positive[:, None] > negative[None, :])
+	ties = np.sum(positive[:, None] == negative[None, :])
+	return float((greater + 0.5*ties)/(len(positive)*len(negative)))
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	size = tuple(int(v) for v in arguments['--size'].split("x"))
+	count, seed = int(arguments['--count']), int(arguments['--seed'])
+	lesions = int(arguments['--lesions'])
+	images = [synthetic.fundus(size, seed + i, (seed + i) % (lesions + 1)) for i in range(count)]
+	PCA = np.loadtxt(os.path.abspath(arguments['PCA']))
+
+	print("Full detector...")
+	full = run(images, det.ODDetector(PCA))
+	print("Cascade...")
+	cascade = run(images, det.ODCascade.from_settings(PCA, float(arguments['--confidence'])))
+
+	print(Fore.GREEN + "{:<8} {:>10} {:>10} {:>12} {:>9} {:>9}".format(
+		"mode", "mean (ms)", "p95 (ms)", "err p50 (r)", "hit rate", "conf AUC") + Style.RESET_ALL)
+	for name, stats in [("full", full), ("cascade", cascade)]:
+		area = auc(stats["confidence"], stats["hits"])
+		print("{:<8} {:10.1f} {:10.1f} {:12.2f} {:>9} {:>9}".format(
+			name, np.mean(stats["ms"]), np.percentile(stats["ms"], 95), np.median(stats["error_radii"]),
+			"{:.0%}".format(np.mean(stats["hits"])), "-" if area is None else "{:.2f}".format(area)))
+
+	tiers = {}
+	for tier, hit in zip(cascade["tier"], cascade["hits"]):
+		resolved, right = tiers.get(tier, (0, 0))
+		tiers[tier] = (resolved + 1, right + hit)
+	for tier, (resolved, right) in tiers.items():
+		print("{:.<22} {:d} images, {:d} right".format(tier, resolved, right))
+	saved = 1 - np.sum(cascade["ms"])/np.sum(full["ms"])
+	print("Time saved............ {:.0%}".format(saved))
+
+	if arguments['--output']:
+		with open(arguments['--output'], "w") as f:
+			json.dump({"cores": os.cpu_count(), "size": list(size), "full": full, "cascade": cascade,
+					   "time_saved": float(saved)}, f, indent=2)
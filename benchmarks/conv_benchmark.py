@@ -0,0 +1,108 @@
+""" Convolution Benchmark
+
+This script times the methods of filtering.image_conv (the
+separable, direct and DFT filters, see filtering.plan_conv)
+for kernel sizes 3 to 61, on a rank 1 kernel (Gaussian) and
+on a dense one (random weights), and checks the method the
+planner picks against the fastest one. The differences with
+cv2.filter2D are reported too (grey levels).
+
+Usage:
+    conv_benchmark.py [options]
+
+Options:
+    --size=<s>      HEIGHTxWIDTH of the synthetic image [default: 1000x1000].
+    --image=<f>     Use this image (grey) instead of the synthetic one.
+    --sizes=<l>     Comma separated kernel sizes
+                    [default: 3,5,7,9,11,15,21,31,45,61].
+    --repeat=<n>    Best of n runs for each time [default: 3].
+    --output=<f>    Save the results to a JSON file.
+"""
+
+import os, sys, time, json, cv2
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import filtering as fil
+import synthetic
+
+
+def best_time(function, repeat):
+	"""
+	Returns the best time (ms) of repeat calls of the function
+	and its last result.
+	"""
+	best = np.inf
+	for _ in range(repeat):
+		start = time.perf_counter()
+		result = function()
+		best = min(best, time.perf_counter() - start)
+	return 1000*best, result
+
+
+def run(image, kernel, repeat):
+	"""
+	This function will time every method that can apply the
+	kernel to the image.
+
+	Returns:
+		dict with the time (ms) and the max difference with
+		cv2.filter2D of each method, the planned method and
+		the fastest one.
+	"""
+	reference = cv2.filter2D(image, -1, kernel)
+	results = {"methods": {}}
+	for method in ["separable", "direct", "dft"]:
+		try:
+			fil.plan_conv(image.shape, image.dtype, kernel, method)
+		except ValueError:
+			continue # Not separable
+		ms, result = best_time(lambda: fil.image_conv(image, kernel, method), repeat)
+		results["methods"][method] = {"ms": ms,
+			"max_diff": int(np.max(np.abs(result.astype(int) - reference)))}
+	results["planned"] = fil.plan_conv(image.shape, image.dtype, kernel).method
+	results["fastest"] = min(results["methods"], key=lambda m: results["methods"][m]["ms"])
+	return results
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	if arguments['--image']:
+		image = cv2.imread(os.path.abspath(arguments['--image']), cv2.IMREAD_GRAYSCALE)
+	else:
+		size = tuple(int(v) for v in arguments['--size'].split("x"))
+		image = cv2.cvtColor(synthetic.fundus(size)[0], cv2.COLOR_BGR2GRAY)
+	repeat = int(arguments['--repeat'])
+	rng = np.random.RandomState(0)
+
+	print(Fore.GREEN + "{:<9} {:>4} {:>10} {:>10} {:>10} {:>10} {:>9}".format(
+		"kernel", "size", "sep (ms)", "dir (ms)", "dft (ms)", "planned", "fastest") + Style.RESET_ALL)
+	report = {"cores": os.cpu_count(), "image": list(image.shape), "results": []}
+	for n in [int(v) for v in arguments['--sizes'].split(",")]:
+		kernels = {"gaussian": np.array(fil.gaussian_kernel(n, [0,0], (n/4)**2)),
+				   "dense": rng.uniform(0, 1, (n, n))/(n*n/2)}
+		for name, kernel in kernels.items():
+			results = run(image, kernel, repeat)
+			times = ["{:.1f}".format(results["methods"][m]["ms"]) if m in results["methods"] else "-"
+					 for m in ["separable", "direct", "dft"]]
+			colour = Fore.GREEN if results["planned"] == results["fastest"] else Fore.YELLOW
+			print("{:<9} {:4d} {:>10} {:>10} {:>10} {:>10} {}{:>9}{}".format(
+				name, n, *times, results["planned"], colour, results["fastest"], Style.RESET_ALL))
+			report["results"].append(dict(results, kernel=name, size=n))
+
+	diffs = [m["max_diff"] for r in report["results"] for m in r["methods"].values()]
+	print("Max difference with cv2.filter2D: {:d} grey levels".format(max(diffs)))
+
+	if arguments['--output']:
+		with open(arguments['--output'], "w") as f:
+			json.dump(report, f, indent=2)
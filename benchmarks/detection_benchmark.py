@@ -0,0 +1,206 @@
+""" Detection Benchmark
+
+This script runs detect_od.py's per-image pipeline (read,
+detect, crop) end to end on synthetic fundus images (see
+synthetic.py) at several resolutions. It reports the
+latency percentiles, the peak memory and the localisation
+error against the known disc position, and saves them as
+a JSON file so two commits can be compared on the same
+machine (see the compare command).
+
+Usage:
+    detection_benchmark.py run PCA OUTPUT [options]
+    detection_benchmark.py compare OLD NEW
+
+Arguments:
+    PCA             The path to the PCA file.
+    OUTPUT          The path of the JSON results file.
+    OLD             JSON results file of the baseline.
+    NEW             JSON results file to compare with it.
+
+Options:
+    --sizes=<s>     Comma separated HEIGHTxWIDTH image sizes
+                    [default: 480x640,1000x1500,2000x3000].
+    --count=<n>     Number of images per size [default: 20].
+    --seed=<n>      Seed of the first image [default: 0].
+    --no-cast       Use the closed form TM_CCOEFF map.
+    --pyramid       Use the coarse to fine search.
+    --kmeans=<m>    K-means of the OD region [default: histogram].
+    --reduced       Use the reduced-resolution decode.
+    --no-crops      Do not write the OD crops.
+"""
+
+import os, sys, time, json, shutil, tempfile, platform, subprocess, tracemalloc, cv2
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import utilities as ut
+import detection as det
+import detect_od
+import synthetic
+
+
+def commit_id():
+	"""
+	Returns the current git commit of the repository (with
+	a "+" when there are local changes), or None.
+	"""
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	try:
+		commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=root)
+		dirty = subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root)
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	return commit.decode().strip() + ("+" if dirty.strip() else "")
+
+
+def percentiles(values):
+	"""
+	Returns the dict of summary statistics of the values.
+	"""
+	values = np.asarray(values, dtype=np.float64)
+	stats = {"mean": np.mean(values), "max": np.max(values)}
+	for p in [50, 90, 95, 99]:
+		stats["p{:d}".format(p)] = np.percentile(values, p)
+	return {key: float(value) for key, value in stats.items()}
+
+
+def run_size(size, count, seed, detector, run_settings, work_path):
+	"""
+	This function will generate the images of one size and
+	run the detection pipeline on them.
+
+	Args:
+		size - (height, width) tuple of the images.
+		count - int, number of images.
+		seed - int, seed of the first image.
+		detector - detection.ODDetector used for the images.
+		run_settings - dict with the detect_od run settings.
+		work_path - string, directory for the images.
+
+	Returns:
+		dict with the latency, memory and error statistics.
+	"""
+	# Generate the images first (JPEGs, so the decode is timed)
+	discs = []
+	for i in range(count):
+		image, disc = synthetic.fundus(size, seed + i)
+		path = os.path.join(work_path, "{:d}x{:d}_{:04d}.jpg".format(size[0], size[1], i))
+		cv2.imwrite(path, image)
+		discs.append((path, disc))
+
+	# Warm up (first call allocations, lazy imports)
+	detect_od.process_image(1, discs[0][0], detector, run_settings)
+
+	latency, peak, errors, hits, fallbacks = [], [], [], 0, 0
+	for i, (path, disc) in enumerate(discs):
+		cv2.setRNGSeed(seed + i)
+		start = time.perf_counter()
+		result = detect_od.process_image(1, path, detector, run_settings)
+		latency.append(1000*(time.perf_counter() - start))
+
+		# Second run for the memory (tracing slows it down)
+		tracemalloc.start()
+		cv2.setRNGSeed(seed + i)
+		detect_od.process_image(1, path, detector, run_settings)
+		peak.append(tracemalloc.get_traced_memory()[1]/2**20)
+		tracemalloc.stop()
+
+		# Distance from the box centre to the disc centre
+		x1, y1, x2, y2 = result["row"][1:5]
+		x, y = (x1 + x2)/2, (y1 + y2)/2
+		dx, dy = disc["centre"]
+		error = np.hypot(x - dx, y - dy)
+		errors.append((error, error/disc["radius"]))
+		hits += x1 <= dx <= x2 and y1 <= dy <= y2
+		fallbacks += result["row"][detect_od.RESULTS_HEADER.index("fallback")]
+
+	errors = np.array(errors)
+	return {"count": count,
+			"latency_ms": percentiles(latency),
+			"peak_mb": percentiles(peak),
+			"error_px": percentiles(errors[:, 0]),
+			"error_radii": percentiles(errors[:, 1]),
+			"hit_rate": hits/count,
+			"fallbacks": int(fallbacks)}
+
+
+def compare(old, new):
+	"""
+	Prints the main metrics of two results files side by side.
+	"""
+	print(Fore.BLUE + "OLD: {} ({})".format(old["meta"]["commit"], old["meta"]["date"]))
+	print("NEW: {} ({})".format(new["meta"]["commit"], new["meta"]["date"]) + Style.RESET_ALL)
+	metrics = [("latency_ms", "p50"), ("latency_ms", "p95"), ("peak_mb", "max"),
+			   ("error_radii", "p50"), ("error_radii", "p95")]
+	for size in old["results"]:
+		if size not in new["results"]:
+			continue
+		print(Fore.GREEN + size + Style.RESET_ALL)
+		for metric, stat in metrics:
+			a, b = old["results"][size][metric][stat], new["results"][size][metric][stat]
+			change = 100*(b - a)/a if a else 0.0
+			print("{:<22} {:10.3f} {:10.3f} {:+8.1f}%".format(metric + " " + stat, a, b, change))
+		a, b = old["results"][size]["hit_rate"], new["results"][size]["hit_rate"]
+		print("{:<22} {:10.3f} {:10.3f}".format("hit_rate", a, b))
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	if arguments['compare']:
+		with open(arguments['OLD']) as f_old, open(arguments['NEW']) as f_new:
+			compare(json.load(f_old), json.load(f_new))
+		sys.exit(0)
+
+	sizes = [tuple(int(v) for v in s.split("x")) for s in arguments['--sizes'].split(",")]
+	count, seed = int(arguments['--count']), int(arguments['--seed'])
+
+	# Same settings as detect_od.py
+	settings = {"N": 450, "window": (30, 30), "stride": 5,
+				"cast": not arguments['--no-cast'], "kmeans": arguments['--kmeans'],
+				"pyramid": arguments['--pyramid']}
+	PCA = np.loadtxt(os.path.abspath(arguments['PCA']))
+	detector = det.ODDetector(PCA, **settings)
+
+	work_path = tempfile.mkdtemp(prefix="detection_benchmark_")
+	run_settings = {"out_path": work_path, "audit": 0,
+					"reduced": arguments['--reduced'], "crops": not arguments['--no-crops'],
+					"cascade": None}
+
+	report = {"meta": {"commit": commit_id(),
+					   "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+					   "platform": platform.platform(),
+					   "python": platform.python_version(),
+					   "numpy": np.__version__,
+					   "opencv": cv2.__version__,
+					   "threads": cv2.getNumThreads(),
+					   "count": count, "seed": seed,
+					   "settings": dict(settings, **{key: run_settings[key] for key in ["reduced", "crops"]})},
+			  "results": {}}
+	try:
+		for size in sizes:
+			name = "{:d}x{:d}".format(*size)
+			ut.update_line("Benchmarking {}...".format(name))
+			stats = run_size(size, count, seed, detector, run_settings, work_path)
+			report["results"][name] = stats
+			print("\n" + Fore.GREEN + name + Style.RESET_ALL)
+			print("Latency (ms).......... p50 {p50:.1f}, p95 {p95:.1f}, max {max:.1f}".format(**stats["latency_ms"]))
+			print("Peak memory (MB)...... max {max:.1f}".format(**stats["peak_mb"]))
+			print("Error (disc radii).... p50 {p50:.2f}, p95 {p95:.2f}".format(**stats["error_radii"]))
+			print("Disc centre in box.... {:.1f}%".format(100*stats["hit_rate"]))
+	finally:
+		shutil.rmtree(work_path, ignore_errors=True)
+
+	with open(arguments['OUTPUT'], "w") as f:
+		json.dump(report, f, indent=2, sort_keys=True)
+	print(Fore.BLUE + "Results saved to {}".format(arguments['OUTPUT']) + Style.RESET_ALL)
@@ -0,0 +1,115 @@
+""" K-Means Benchmark
+
+This script compares the histogram k-means (the default of
+detection.ODDetector) against OpenCV's cv2.kmeans on the OD
+regions of real images. It reports the latency of the
+clustering step and how different the results are (cluster
+centres, brightest cluster and the final OD boxes).
+
+Usage:
+    kmeans_benchmark.py ROOT PCA [--limit=<n>]
+
+Arguments:
+    ROOT            The root directory of the image dataset.
+    PCA             The path to the PCA file.
+
+Options:
+    --limit=<n>     Max number of images to use [default: 100].
+"""
+
+import os, sys, time, cv2
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import files
+import utilities as ut
+import detection as det
+
+
+def box_iou(a, b):
+	"""
+	Returns the intersection over union of two
+	(x1, y1, x2, y2) boxes.
+	"""
+	w = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+	h = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+	union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - w*h
+	return w*h/union if union > 0 else 0.0
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+	root_path = files.abspath(arguments['ROOT'])
+	pca_path = files.abspath(arguments['PCA'])
+
+	images = files.get_images(root_path)[:int(arguments['--limit'])]
+	print(Fore.GREEN + "Number of images used: {:d}".format(len(images)) + Style.RESET_ALL)
+
+	# One detector per k-means mode
+	PCA = np.loadtxt(pca_path)
+	opencv = det.ODDetector(PCA, kmeans="opencv")
+	histogram = det.ODDetector(PCA, kmeans="histogram")
+
+	times = {"opencv": [], "histogram": []}
+	centre_diff, mask_iou, boxes_iou = [], [], []
+
+	size = 20 # Length of the loading bar in chars
+	for i, img_path in enumerate(images):
+		image = ut.read_image(img_path, "BGR2GRAY")
+
+		# Same OD region as the detector (from the parabola vertex)
+		detection = opencv.detect(image)
+		resized = cv2.resize(image, (opencv.N, opencv.N), cv2.INTER_AREA)
+		x1, y1, x2, y2 = opencv.region(*det.parabola_vertex(detection.params))
+		region = resized[y1:y2, x1:x2]
+		if region.size == 0:
+			continue
+
+		# Time the clustering step only
+		clustered = {}
+		for name, detector in [("opencv", opencv), ("histogram", histogram)]:
+			start = time.perf_counter()
+			clustered[name] = detector.cluster(region)
+			times[name].append(time.perf_counter() - start)
+
+		# Compare the centres and the brightest cluster (the OD)
+		centres = [np.unique(clustered[name]) for name in ["opencv", "histogram"]]
+		if len(centres[0]) == len(centres[1]):
+			centre_diff.append(np.max(np.abs(centres[0].astype(int) - centres[1].astype(int))))
+		masks = [clustered[name] == np.max(clustered[name]) for name in ["opencv", "histogram"]]
+		mask_iou.append(np.sum(masks[0] & masks[1])/max(np.sum(masks[0] | masks[1]), 1))
+
+		# Compare the final boxes
+		boxes_iou.append(box_iou(detection.box, histogram.detect(image).box))
+
+		# Progress bar stuff
+		perc = (i+1)/len(images)
+		bar = int(np.round(perc*size))
+		line = "Benchmarking ["
+		line += "="*bar + " "*(size-bar)
+		line += "] {:d}%".format(int(np.round(perc*100)))
+		ut.update_line(line) # Thins func will use carriage return
+
+	# Print the summary
+	print("\n" + Fore.BLUE + "Clustering latency (ms):" + Style.RESET_ALL)
+	for name, values in times.items():
+		values = 1000*np.array(values)
+		print("{:<10} mean {:8.3f}  p50 {:8.3f}  p95 {:8.3f}".format(
+			name, np.mean(values), np.percentile(values, 50), np.percentile(values, 95)))
+	print("Speedup............... {:.1f}x".format(np.mean(times["opencv"])/np.mean(times["histogram"])))
+
+	print(Fore.BLUE + "Output difference:" + Style.RESET_ALL)
+	print("Max centre diff....... median {:.1f}, max {:.1f} (grey levels)".format(
+		np.median(centre_diff), np.max(centre_diff)))
+	print("Brightest cluster IoU. mean {:.3f}".format(np.mean(mask_iou)))
+	print("OD box IoU............ mean {:.3f}, {:.1f}% above 0.9".format(
+		np.mean(boxes_iou), 100*np.mean(np.array(boxes_iou) > 0.9)))
@@ -0,0 +1,86 @@
+""" Latency Benchmark
+
+This script measures how long detection.ODDetector takes
+to detect the OD in a single image (the interactive use
+case) with different numbers of threads for the row bands
+of the correlation stage (uint8 cast, closed form or
+pyramid search).
+
+Usage:
+    latency_benchmark.py PCA [options]
+
+Arguments:
+    PCA             The path to the PCA file.
+
+Options:
+    --image=<path>  Image to use, a synthetic one if not given.
+    --size=<s>      HEIGHTxWIDTH of the synthetic image [default: 2000x3000].
+    --threads=<l>   Comma separated thread counts [default: 1,2,4,8].
+    --repeats=<n>   Number of timed runs per count [default: 20].
+    --no-cast       Use the closed form TM_CCOEFF map.
+    --pyramid       Use the coarse to fine search.
+    --output=<f>    Save the results to a JSON file.
+"""
+
+import os, sys, time, json, cv2
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import utilities as ut
+import detection as det
+import synthetic
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	if arguments['--image']:
+		image = ut.read_image(arguments['--image'], "BGR2GRAY")
+	else:
+		size = tuple(int(v) for v in arguments['--size'].split("x"))
+		image = cv2.cvtColor(synthetic.fundus(size)[0], cv2.COLOR_BGR2GRAY)
+
+	PCA = np.loadtxt(os.path.abspath(arguments['PCA']))
+	repeats = int(arguments['--repeats'])
+	print(Fore.GREEN + "Image size: {}x{}, cores: {}".format(
+		image.shape[0], image.shape[1], os.cpu_count()) + Style.RESET_ALL)
+
+	settings = {"cast": not arguments['--no-cast'], "pyramid": arguments['--pyramid']}
+	results, boxes = {}, set()
+	for threads in [int(t) for t in arguments['--threads'].split(",")]:
+		with det.ODDetector(PCA, threads=threads, **settings) as detector:
+			detector.detect(image) # Warm up (thread start, first allocations)
+
+			latency = []
+			for _ in range(repeats):
+				detector.centres = None # Same k-means start for every run
+				start = time.perf_counter()
+				boxes.add(detector.detect(image).box)
+				latency.append(1000*(time.perf_counter() - start))
+
+		results[threads] = {"p50": float(np.percentile(latency, 50)),
+							"p95": float(np.percentile(latency, 95)),
+							"min": float(np.min(latency))}
+
+	# Print the table (speedup of the median against the first count)
+	base = results[min(results)]["p50"]
+	print("{:>8} {:>10} {:>10} {:>10} {:>8}".format("threads", "p50 (ms)", "p95 (ms)", "min (ms)", "speedup"))
+	for threads, stats in sorted(results.items()):
+		print("{:>8d} {:10.1f} {:10.1f} {:10.1f} {:7.2f}x".format(
+			threads, stats["p50"], stats["p95"], stats["min"], base/stats["p50"]))
+	if len(boxes) > 1:
+		print(Fore.RED + "The boxes changed with the thread count: {}".format(boxes) + Style.RESET_ALL)
+
+	if arguments['--output']:
+		with open(arguments['--output'], "w") as f:
+			json.dump({"cores": os.cpu_count(), "shape": list(image.shape), "settings": settings,
+					   "repeats": repeats, "results": results}, f, indent=2)
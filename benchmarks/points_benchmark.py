@@ -0,0 +1,159 @@
+""" Point Source Benchmark
+
+This script compares the two sources of the parabola fit
+points of detection.ODDetector: the PCA correlation array
+and the vessel map (black top-hat of the green channel).
+Both detectors see the same images, and the script reports
+the time of each source and of the whole detection, the
+agreement between the two (parabola vertex distance and box
+IoU) and, on the synthetic images (see synthetic.py), the
+error of each one against the known disc position.
+
+Usage:
+    points_benchmark.py PCA [options]
+
+Arguments:
+    PCA             The path to the PCA file.
+
+Options:
+    --size=<s>      HEIGHTxWIDTH of the synthetic images [default: 1000x1000].
+    --count=<n>     Number of synthetic images [default: 20].
+    --seed=<n>      Seed of the first image [default: 0].
+    --images=<dir>  Also compare the sources on the images of this
+                    directory (agreement only, no known disc).
+    --output=<f>    Save the results to a JSON file.
+"""
+
+import os, sys, time, json, cv2
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import files
+import detection as det
+import synthetic
+
+
+# Stage of each point source (see detection.ODDetector)
+STAGES = {"pca": "correlation", "vessels": "vessels"}
+
+
+def box_iou(a, b):
+	"""
+	Returns the intersection over union of two (x1, y1, x2, y2) boxes.
+	"""
+	width = min(a[2], b[2]) - max(a[0], b[0])
+	height = min(a[3], b[3]) - max(a[1], b[1])
+	inter = max(width, 0)*max(height, 0)
+	union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter
+	return inter/union if union > 0 else 0.0
+
+
+def run_images(images, detectors):
+	"""
+	This function will detect the OD in the images with each
+	detector and measure the times and the agreement.
+
+	Args:
+		images - list of (BGR image, disc) tuples, disc is None
+			when the disc position is not known.
+		detectors - dict {source: detection.ODDetector}.
+
+	Returns:
+		dict with the statistics of each source and of the
+		agreement between them.
+	"""
+	stats = {source: {"total_ms": [], "source_ms": [], "error_radii": [], "hits": 0}
+			 for source in detectors}
+	vertices, ious = [], []
+	for i, (image, disc) in enumerate(images):
+		detections = {}
+		for source, detector in detectors.items():
+			detector.centres = None # Same k-means start for both
+			cv2.setRNGSeed(i)
+			start = time.perf_counter()
+			detections[source] = detector.detect(image)
+			stats[source]["total_ms"].append(1000*(time.perf_counter() - start))
+			stats[source]["source_ms"].append(1000*detector.timer.pop().get(STAGES[source], 0.0))
+
+			if disc is not None:
+				x1, y1, x2, y2 = detections[source].box
+				dx, dy = disc["centre"]
+				error = np.hypot((x1 + x2)/2 - dx, (y1 + y2)/2 - dy)
+				stats[source]["error_radii"].append(error/disc["radius"])
+				stats[source]["hits"] += x1 <= dx <= x2 and y1 <= dy <= y2
+
+		# Vertex distance (resized pixels) and box overlap
+		pca, vessels = detections["pca"], detections["vessels"]
+		vertices.append(np.hypot(*np.subtract(det.parabola_vertex(np.array(pca.params)),
+											  det.parabola_vertex(np.array(vessels.params)))))
+		ious.append(box_iou(pca.box, vessels.box))
+
+	results = {}
+	for source, values in stats.items():
+		results[source] = {"total_ms_p50": float(np.percentile(values["total_ms"], 50)),
+						   "total_ms_p95": float(np.percentile(values["total_ms"], 95)),
+						   "source_ms_p50": float(np.percentile(values["source_ms"], 50))}
+		if values["error_radii"]:
+			results[source]["error_radii_p50"] = float(np.median(values["error_radii"]))
+			results[source]["hit_rate"] = values["hits"]/len(images)
+	results["agreement"] = {"vertex_px_p50": float(np.median(vertices)),
+							"vertex_within_30px": float(np.mean(np.array(vertices) <= 30)),
+							"box_iou_p50": float(np.median(ious)),
+							"box_overlap_rate": float(np.mean(np.array(ious) > 0))}
+	return results
+
+
+def print_results(name, results):
+	"""
+	Prints the results of one image set.
+	"""
+	print(Fore.GREEN + name + Style.RESET_ALL)
+	print("{:<8} {:>11} {:>11} {:>11} {:>11} {:>9}".format(
+		"source", "p50 (ms)", "p95 (ms)", "points (ms)", "err (radii)", "hit rate"))
+	for source in STAGES:
+		stats = results[source]
+		print("{:<8} {:11.1f} {:11.1f} {:11.1f} {:>11} {:>9}".format(
+			source, stats["total_ms_p50"], stats["total_ms_p95"], stats["source_ms_p50"],
+			"{:.2f}".format(stats["error_radii_p50"]) if "error_radii_p50" in stats else "-",
+			"{:.0%}".format(stats["hit_rate"]) if "hit_rate" in stats else "-"))
+	agreement = results["agreement"]
+	print("Vertex distance (px).. p50 {:.1f}, {:.0%} within 30px".format(
+		agreement["vertex_px_p50"], agreement["vertex_within_30px"]))
+	print("Box IoU............... p50 {:.2f}, {:.0%} overlapping".format(
+		agreement["box_iou_p50"], agreement["box_overlap_rate"]))
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	PCA = np.loadtxt(os.path.abspath(arguments['PCA']))
+	detectors = {source: det.ODDetector(PCA, points=source, timing=True) for source in STAGES}
+
+	size = tuple(int(v) for v in arguments['--size'].split("x"))
+	count, seed = int(arguments['--count']), int(arguments['--seed'])
+	synthetic_images = [synthetic.fundus(size, seed + i) for i in range(count)]
+
+	report = {"cores": os.cpu_count(), "results": {}}
+	name = "synthetic {:d}x{:d}".format(*size)
+	report["results"][name] = run_images(synthetic_images, detectors)
+	print_results(name, report["results"][name])
+
+	if arguments['--images']:
+		paths = files.get_images(os.path.abspath(arguments['--images']))
+		images = [(cv2.imread(path), None) for path in paths]
+		name = os.path.basename(os.path.normpath(arguments['--images']))
+		report["results"][name] = run_images(images, detectors)
+		print_results(name, report["results"][name])
+
+	if arguments['--output']:
+		with open(arguments['--output'], "w") as f:
+			json.dump(report, f, indent=2)
@@ -0,0 +1,147 @@
+"""
+Synthetic fundus images for the benchmarks.
+
+The images are deterministic (given the seed) and have
+the parts the OD detector looks for: a circular field
+of view, a bright disc and the main vessel arcades, drawn
+as parabolic arcs with their vertex at the disc and
+opening towards the macula. Since the disc position is
+known, the detector accuracy can be measured without
+a labelled dataset.
+"""
+
+import cv2
+import numpy as np
+
+
+def fundus(size, seed=0, lesions=0):
+	"""
+	This function will generate a synthetic fundus image.
+
+	Args:
+		size - (height, width) tuple of the image.
+		seed - int, seed of the random generator.
+		lesions - int, number of bright lesions (exudate like
+			blobs, about as bright as the disc) to add, which
+			make the detection harder.
+
+	Returns:
+		(image, disc) tuple, where image is the BGR uint8 numpy
+		array and disc a dict with the "centre" (x, y) and the
+		"radius" of the disc (in pixels).
+	"""
+	height, width = size
+	rng = np.random.RandomState(seed)
+
+	# Circular field of view
+	cx, cy = width/2, height/2
+	R = 0.49*min(height, width)
+	ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+	r2 = ((xs - cx)**2 + (ys - cy)**2)/R**2
+	field = r2 <= 1
+
+	# Background, orange/red with a vignette and some blotches
+	coarse = rng.uniform(0.85, 1.15, (8, 8)).astype(np.float32)
+	blotches = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+	shade = (1 - 0.45*r2)*blotches
+	image = np.empty((height, width, 3), dtype=np.float32)
+	for channel, value in enumerate([25, 70, 170]):
+		image[..., channel] = value*shade
+
+	# Disc on one side, about half way to the edge
+	side = 1 if rng.rand() < 0.5 else -1
+	dx = cx + side*R*rng.uniform(0.45, 0.6)
+	dy = cy + R*rng.uniform(-0.1, 0.1)
+	radius = R*rng.uniform(0.08, 0.1)
+
+	# Main arcades, x = dx - side*a*(y - dy)^2 (opening to the centre)
+	vessels = np.zeros((height, width), dtype=np.uint8)
+	thickness = max(1, int(round(0.02*R)))
+	ys_arc = np.linspace(dy - 0.95*R, dy + 0.95*R, 200)
+	for k in rng.uniform(0.6, 2.5, 4):
+		a = k/R
+		xs_arc = dx - side*a*(ys_arc - dy)**2
+		points = np.round(np.stack((xs_arc, ys_arc), axis=1)*16).astype(np.int32)
+		cv2.polylines(vessels, [points], False, 255, thickness, cv2.LINE_AA, 4)
+
+	# A few thinner branches leaving the disc
+	for angle in rng.uniform(0, 2*np.pi, 6):
+		length = R*rng.uniform(0.2, 0.5)
+		end = (dx + length*np.cos(angle), dy + length*np.sin(angle))
+		cv2.line(vessels, (int(dx), int(dy)), (int(end[0]), int(end[1])), 160,
+				 max(1, thickness//2), cv2.LINE_AA)
+	vessels = cv2.GaussianBlur(vessels, (0, 0), max(0.5, thickness/4)).astype(np.float32)/255
+	image *= (1 - 0.55*vessels)[..., None]
+
+	# Bright disc with a soft edge and a brighter cup
+	d2 = ((xs - dx)**2 + (ys - dy)**2)/radius**2
+	disc = 0.5 - 0.5*np.tanh(4*(np.sqrt(d2) - 1))
+	cup = np.exp(-d2/0.15)
+	for channel, value in enumerate([140, 200, 245]):
+		image[..., channel] += (value - image[..., channel])*(0.85*disc)
+		image[..., channel] += 30*cup
+
+	# Sensor noise and the black surround
+	image += rng.normal(0, 3, image.shape).astype(np.float32)
+
+	# Bright lesions (drawn last, so the rest does not change)
+	for _ in range(lesions):
+		angle, distance = rng.uniform(0, 2*np.pi), R*np.sqrt(rng.uniform(0, 0.7))
+		lx, ly = cx + distance*np.cos(angle), cy + distance*np.sin(angle)
+		l2 = ((xs - lx)**2 + (ys - ly)**2)/(R*rng.uniform(0.04, 0.1))**2
+		blob = rng.uniform(0.6, 0.95)*np.exp(-l2)
+		for channel, value in enumerate([120, 210, 240]):
+			image[..., channel] += (value - image[..., channel])*blob
+	image[~field] = 0
+	image = np.clip(image, 0, 255).astype(np.uint8)
+
+	return image, {"centre": (float(dx), float(dy)), "radius": float(radius)}
+
+
+def sequence(size, count, seed=0, blinks=1):
+	"""
+	This function will generate the frames of a synthetic
+	fundus video. The retina drifts (small random steps and
+	a few saccades) behind the fixed field of view, and the
+	blinks are a few dark frames.
+
+	Args:
+		size - (height, width) tuple of the frames.
+		count - int, number of frames.
+		seed - int, seed of the random generator.
+		blinks - int, number of blinks.
+
+	Returns:
+		List of (frame, disc) tuples (see fundus), disc is None
+		during the blinks.
+	"""
+	height, width = size
+	rng = np.random.RandomState(seed)
+	image, disc = fundus(size, seed)
+
+	# Field of view of the camera (does not move)
+	ys, xs = np.mgrid[0:height, 0:width]
+	R = 0.49*min(height, width)
+	field = (xs - width/2)**2 + (ys - height/2)**2 <= R**2
+
+	# Eye movements, a random walk with a few saccades
+	steps = rng.normal(0, 0.002*R, (count, 2))
+	saccades = rng.rand(count) < 0.02
+	steps[saccades] = rng.uniform(-0.1*R, 0.1*R, (np.sum(saccades), 2))
+	shifts = np.cumsum(steps, axis=0)
+	blinking = np.zeros(count, dtype=bool)
+	for start in rng.randint(0, max(count - 5, 1), blinks):
+		blinking[start:start + 5] = True
+
+	frames = []
+	for (dx, dy), blink in zip(shifts, blinking):
+		warp = np.float32([[1, 0, dx], [0, 1, dy]])
+		frame = cv2.warpAffine(image, warp, (width, height))
+		frame = np.clip(frame + rng.normal(0, 2, frame.shape), 0, 255).astype(np.uint8)
+		frame[~field] = 0
+		if blink:
+			frames.append(((frame*0.1).astype(np.uint8), None))
+			continue
+		x, y = disc["centre"]
+		frames.append((frame, {"centre": (x + dx, y + dy), "radius": disc["radius"]}))
+	return frames
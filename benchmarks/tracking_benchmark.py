@@ -0,0 +1,96 @@
+""" Tracking Benchmark
+
+This script compares detection.ODTracker with the full
+detection of every frame on a synthetic fundus video (see
+synthetic.sequence), where the disc position of each frame
+is known. It reports the per-frame latency and the error
+of both, and how often the tracker lost the disc.
+
+Usage:
+    tracking_benchmark.py PCA [options]
+
+Arguments:
+    PCA             The path to the PCA file.
+
+Options:
+    --size=<s>      HEIGHTxWIDTH of the frames [default: 720x720].
+    --frames=<n>    Number of frames [default: 300].
+    --seed=<n>      Seed of the sequence [default: 0].
+    --blinks=<n>    Number of blinks [default: 2].
+    --keyframes=<n>  Max frames between two keyframes [default: 30].
+    --output=<f>    Save the results to a JSON file.
+"""
+
+import os, sys, time, json
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+# For loading the main helper scripts
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import detection as det
+import synthetic
+
+
+def run(frames, locate):
+	"""
+	This function will locate the disc in every frame.
+
+	Args:
+		frames - list of (frame, disc) tuples (see synthetic.sequence).
+		locate - function returning the Detection of a frame.
+
+	Returns:
+		dict with the latency (ms) and error (disc radii) statistics.
+	"""
+	latency, errors = [], []
+	for frame, disc in frames:
+		start = time.perf_counter()
+		detection = locate(frame)
+		latency.append(1000*(time.perf_counter() - start))
+		if disc is None:
+			continue # Blink, nothing to find
+		x1, y1, x2, y2 = detection.box
+		dx, dy = disc["centre"]
+		errors.append(np.hypot((x1 + x2)/2 - dx, (y1 + y2)/2 - dy)/disc["radius"])
+
+	return {"latency_ms": {"mean": float(np.mean(latency)), "p50": float(np.percentile(latency, 50)),
+						   "p95": float(np.percentile(latency, 95)), "max": float(np.max(latency))},
+			"error_radii": {"p50": float(np.median(errors)), "p95": float(np.percentile(errors, 95)),
+							"max": float(np.max(errors))}}
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	size = tuple(int(v) for v in arguments['--size'].split("x"))
+	frames = synthetic.sequence(size, int(arguments['--frames']), int(arguments['--seed']),
+								int(arguments['--blinks']))
+	PCA = np.loadtxt(os.path.abspath(arguments['PCA']))
+
+	print("Full detection of every frame...")
+	full = run(frames, det.ODDetector(PCA).detect)
+
+	print("Tracking...")
+	tracker = det.ODTracker(det.ODDetector(PCA), int(arguments['--keyframes']))
+	tracked = run(frames, lambda frame : tracker.update(frame)[0])
+	tracked["lost"] = tracker.lost
+
+	print(Fore.GREEN + "{:<9} {:>10} {:>10} {:>10} {:>12} {:>12}".format(
+		"mode", "mean (ms)", "p50 (ms)", "p95 (ms)", "err p50 (r)", "err p95 (r)") + Style.RESET_ALL)
+	for name, stats in [("full", full), ("tracking", tracked)]:
+		print("{:<9} {:10.1f} {:10.1f} {:10.1f} {:12.2f} {:12.2f}".format(
+			name, stats["latency_ms"]["mean"], stats["latency_ms"]["p50"], stats["latency_ms"]["p95"],
+			stats["error_radii"]["p50"], stats["error_radii"]["p95"]))
+	print("Track lost............ {:d} times".format(tracker.lost))
+
+	if arguments['--output']:
+		with open(arguments['--output'], "w") as f:
+			json.dump({"cores": os.cpu_count(), "frames": len(frames), "size": list(size),
+					   "full": full, "tracking": tracked}, f, indent=2)
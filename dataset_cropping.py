@@ -8,8 +8,8 @@ to the output directory.
 
 
 Usage:
-    dataset_cropping.py ROOT OUTPUT 
-    dataset_cropping.py ROOT OUTPUT -x WID -y HEI
+    dataset_cropping.py ROOT OUTPUT [--fast]
+    dataset_cropping.py ROOT OUTPUT -x WID -y HEI [--fast]
 
 Arguments:
     ROOT                 The root directory of the image dataset.
@@ -20,6 +20,8 @@ Arguments:
 Options:
 	-x WID --width=WID    Indicates resize image with given width.
 	-y HEI --height=HEI   Indicates resize image with given height.
+	--fast                Find the eye on a thumbnail of the image, much
+	                      faster on large images (see analysis.field_rect).
 """
 
 import files, cv2 # For the file management stuff
@@ -59,7 +61,8 @@ if __name__== "__main__":
 	# For now, just print out settings and  all the images in the root.
 	print(Fore.BLUE + "Settings passed: ")
 	print("Root directory........ %s" % root_path)
-	print("Output directory...... %s\n" % out_path)
+	print("Output directory...... %s" % out_path)
+	print("Fast bounding box..... %s\n" % arguments['--fast'])
 
 	# Check that both directories exist
 	if os.path.lexists(out_path) and os.path.lexists(root_path):
@@ -96,7 +99,7 @@ if __name__== "__main__":
 		image = ut.read_image(img_path, "BGR2RGB") #grayscale
 
 		# Do the image cropping and save to the output
-		rect = an.get_rect(image) # Ruple with bounding rect coords
+		rect = an.get_rect(image, arguments['--fast']) # Ruple with bounding rect coords
 		cropped = image[rect[1]:rect[3],rect[0]:rect[2]] # Simple cropping
 
 		# This is the resizing stuff. Here I am assuming we
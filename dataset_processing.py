@@ -8,7 +8,7 @@ Processing directory.
 
 
 Usage:
-    dataset_cropping.py ROOT OUTPUT STATS HIST [-v]
+    dataset_cropping.py ROOT OUTPUT STATS HIST [-v] [--exact]
 
 
 Arguments:
@@ -19,6 +19,8 @@ Arguments:
 
 Options:
     -v --view         Viewing option, no saving.
+    --exact           Match the model histogram counts exactly (pixel
+                      ranks) instead of with the lookup table.
 """
 
 import files, cv2 # For the file management stuff
@@ -85,6 +87,7 @@ if __name__== "__main__":
 
 	# Open the histogram file should be [N,2]
 	model_hist = np.loadtxt(hist_path)
+	model_cdf = an.histogram_cdf(model_hist) # Same for all the images
 
 	# Now we open the stats and calculate the stuff we want
 	stats = np.loadtxt(stats_path)
@@ -96,8 +99,7 @@ if __name__== "__main__":
 
 	# Precalculate the deblurring stuff
 	a, b = 5, 4 # Weights for the unsharp mask
-	gaussian_kernel = ft.gaussian_kernel(7, [0,0], 10) 
-	unsharp_mask = a*ft.delta(7) - b*gaussian_kernel # The filter we want
+	unsharp_mask = ft.unsharp_kernel(7, 10, a, b) # The filter we want
 
 	# Jut for the distribution visualization
 	plt.plot(norm_stats[:,0], norm_stats[:,1], "x")
@@ -121,7 +123,7 @@ if __name__== "__main__":
 			image = ft.image_conv(image, unsharp_mask)
 
 		# Match the histogram
-		final = an.match_histogram(image, model_hist)
+		final = an.match_histogram(image, model_hist, arguments['--exact'], model_cdf)
 
 		# Save the image to disc
 		name = files.get_filename(img_path) + ".jpg"
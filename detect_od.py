@@ -2,29 +2,341 @@
 
 This script will open images in a dataset and 
 detect the OD in each image. The resulting fitted
-OD images will be saved in the OUTPUT directory.
+OD images will be saved in the OUTPUT directory,
+along with a CSV file with the boxes and scores.
 
 Note: The input images must be normalised beforehand.
 
 Usage:
-    detect_od.py ROOT OUTPUT PCA
+    detect_od.py ROOT OUTPUT PCA [options]
 
 Arguments:
     ROOT            The root directory of the image dataset.
     OUTPUT          The output directory to save the analysis files.
     PCA 			The path to the PCA file
+
+Options:
+    --no-cast       Score the windows with the closed form TM_CCOEFF
+                    map (no uint8 cast of the PCA reconstructions).
+    --pyramid       Coarse to fine search, only the top coarse peaks
+                    are scored at full resolution.
+    --levels=<n>    Number of pyramid levels [default: 1].
+    --top-k=<k>     Number of coarse peaks to refine [default: 5].
+    --audit=<n>     Check every n-th image against the full scan to
+                    count coarse misses, 0 disables it [default: 10].
+    --robust-fit    Drop stray points (e.g. vessel responses) when
+                    fitting the parabola.
+    --kmeans=<m>    K-means of the OD region, "histogram" (on the 256
+                    bin histogram) or "opencv" (cv2.kmeans on all the
+                    pixels) [default: histogram].
+    --points=<m>    Points of the parabola fit, "pca" (the PCA window
+                    correlation) or "vessels" (black top-hat of the
+                    green channel, much faster) [default: pca].
+    --localiser=<m>
+                    Brightness pre-localiser, "seed" (refine the
+                    pyramid search around the brightest disc sized
+                    boxes), "replace" (use the brightest box instead
+                    of the parabola) or "none" (only when the fit or
+                    the refinement fail) [default: none].
+    --cascade       Run the cheap detectors first (brightest box,
+                    then the vessel map fit), the detector set by
+                    the options above only runs on the images they
+                    are not confident about.
+    --confidence=<c>
+                    Min confidence (0 to 1) to accept the detection
+                    of a cheap tier of the cascade [default: 0.15].
+    --jobs=<n>      Number of worker processes [default: 1].
+    --batch=<n>     Number of images whose windows are projected
+                    together [default: 1].
+    --threads=<n>   Number of threads for the correlation of each
+                    image (row bands), for low latency [default: 1].
+    --timing        Time the stages of the pipeline, print their
+                    summary at the end and save the times of each
+                    image to a JSON lines trace in OUTPUT.
+    --force         Reprocess the images already in the run journal.
+    --reduced       Decode the images at a reduced size for the
+                    detection, the full resolution image is only
+                    read to cut out the OD.
+    --no-crops      Only write the results file (no OD images).
 """
 
 import files # For the file management stuff
-import os, sys, cv2 # For directory changing, sys stuff
+import os, sys, cv2, csv, json, time # For directory changing, sys stuff
 import utilities as ut
-import analysis as an
+import detection as det
+import timing as tm
 import numpy as np
 from colorama import Style, Fore, init # Colouring CLI stuff
 from docopt import docopt # CLI argument parser 
-from matplotlib import pyplot as plt
-from scipy.optimize import curve_fit
-from sklearn.mixture import GaussianMixture as GMM
+from multiprocessing import Pool, RawArray
+
+
+# Name of the run journal (saved in the OUTPUT directory)
+JOURNAL = "detect_od_journal.csv"
+
+# Name and columns of the results file (saved in the OUTPUT
+# directory). The box is in the original image coordinates
+# and a, b, c are the parabola parameters (cols = a*rows^2
+# + b*rows + c in the resized image), tier is the cascade
+# tier of the box (empty without --cascade)
+RESULTS = "detect_od_results.csv"
+RESULTS_HEADER = ["name", "x1", "y1", "x2", "y2", "a", "b", "c", "score", "fallback", "confidence", "tier"]
+
+# Name of the stage times trace (--timing, saved in OUTPUT)
+TRACE = "detect_od_trace.jsonl"
+
+def signature(img_path):
+	"""
+	Returns the (name, size, mtime) tuple used to tell if
+	an image was already processed (all strings, same as
+	they are read back from the journal).
+	"""
+	stats = os.stat(img_path)
+	return (os.path.basename(img_path), str(stats.st_size), str(stats.st_mtime_ns))
+
+
+def load_journal(journal_path):
+	"""
+	This function will read the run journal and return
+	the set of signatures of the completed images. A
+	missing journal just means nothing was done yet.
+	"""
+	if not os.path.isfile(journal_path):
+		return set()
+
+	with open(journal_path, "r", newline="") as f:
+		reader = csv.reader(f)
+		next(reader, None) # Skip the header
+		return set(tuple(row) for row in reader if len(row) == 3)
+
+
+def drop_results(results_path, names):
+	"""
+	This function will remove the rows of the given image
+	names from the results file, so the images queued again
+	(e.g. changed since the last run) keep only their new
+	row. The file is only rewritten when rows are dropped.
+	"""
+	with open(results_path, "r", newline="") as f:
+		rows = list(csv.reader(f))
+	kept = rows[0:1] + [row for row in rows[1:] if not row or row[0] not in names]
+	if len(kept) == len(rows):
+		return
+
+	# Written aside first, so a failed write keeps the old file
+	temp_path = results_path + ".tmp"
+	with open(temp_path, "w", newline="") as f:
+		csv.writer(f).writerows(kept)
+	os.replace(temp_path, results_path)
+
+
+# Detector of each worker process (see init_worker)
+_detector, _settings = None, None
+
+def make_detector(PCA, settings, cascade=None):
+	"""
+	Returns the detection.ODDetector with the settings, or the
+	detection.ODCascade ending with it when cascade is the
+	confidence threshold of the cheap tiers.
+	"""
+	if cascade is None:
+		return det.ODDetector(PCA, **settings)
+	return det.ODCascade.from_settings(PCA, cascade, **settings)
+
+
+def init_worker(shared_PCA, shape, settings, run_settings):
+	"""
+	Pool initializer. The PCA matrix is read from the
+	parent's shared memory (read only, not pickled for each
+	task) and the detector is built once per worker.
+	"""
+	global _detector, _settings
+	cv2.setNumThreads(1) # The pool already uses the cores
+
+	PCA = np.frombuffer(shared_PCA).reshape(shape)
+	PCA.flags.writeable = False
+	_detector = make_detector(PCA, settings, run_settings['cascade'])
+	_settings = run_settings
+
+
+def worker_task(tasks):
+	"""
+	Runs process_batch in a worker with its detector.
+	"""
+	return process_batch(tasks, _detector, _settings)
+
+
+def load_image(img_path, detector, run_settings):
+	"""
+	This function will read an image for the detection.
+
+	Args:
+		img_path - string representing the path of the image.
+		detector - detection.ODDetector (or ODCascade) used for the image.
+		run_settings - dict with the run settings.
+
+	Returns:
+		(image, original_size, original_image) tuple. With the
+		reduced decode, image is the small grey image and the
+		original one is only read later for the crop (None).
+		The vessel map needs the green channel, so image is
+		BGR then (the original image is always grey).
+
+	Raises:
+		IOError when the image can not be read (e.g. a corrupt
+		or truncated file).
+	"""
+	colour = detector.points == "vessels"
+	with detector.timer.stage("decode"):
+		if run_settings['reduced']:
+			image, original_size = ut.read_reduced(img_path, detector.N, colour)
+			if image is None:
+				raise IOError("Could not read the image")
+			return image, original_size, None
+
+		image = cv2.imread(img_path)
+		if image is None:
+			raise IOError("Could not read the image")
+		original_image = ut.convert_spaces(image, "BGR2GRAY")
+		if colour:
+			return image, image.shape[0:2], original_image
+		return original_image, original_image.shape[0:2], original_image
+
+
+def failed_result(img_path, error):
+	"""
+	Returns the result of an image that could not be read
+	(see save_result), with its error message. These images
+	are not journaled, so the next run tries them again.
+	"""
+	return {"path": img_path, "error": str(error), "found": False, "row": None, "timings": {},
+			"audited": False, "missed": False, "tier": None, "tier_times": {}}
+
+
+def save_result(img_path, detection, original_size, original_image, detector, run_settings):
+	"""
+	This function will save the cropped OD to the output
+	directory (unless the crops are disabled) and return
+	the result of the image.
+
+	Args:
+		img_path - string representing the path of the image.
+		detection - detection.Detection of the image.
+		original_size - (height, width) of the original image.
+		original_image - grey original image, or None to read
+			it (grey, no colour conversion) when needed.
+		detector - detection.ODDetector used for the image.
+		run_settings - dict with the run settings.
+
+	Returns:
+		dict with the image path, whether or not the OD box is
+		inside the image, the pyramid audit results, the row
+		for the results file, the stage times (timings), the
+		cascade tier and the times of the tiers it ran.
+	"""
+	x1, y1, x2, y2 = detection.box
+
+	# The box can end up outside the image when the parabola
+	# vertex is off the image (same check as slicing it)
+	height, width = original_size
+	found = len(range(height)[y1:y2]) > 0 and len(range(width)[x1:x2]) > 0
+
+	# Now we save the OD
+	if found and run_settings['crops']:
+		if original_image is None:
+			with detector.timer.stage("decode"):
+				original_image = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+		with detector.timer.stage("write"):
+			od = original_image[y1:y2,x1:x2]
+			cv2.imwrite(files.append_path(run_settings['out_path'], files.get_filename(img_path)+".jpg"), od)
+
+	row = [os.path.basename(img_path), x1, y1, x2, y2]
+	row += ["{:.9g}".format(p) for p in detection.params]
+	row += ["{:.6g}".format(detection.score), int(detection.fallback)]
+	row += ["{:.3f}".format(detection.confidence), detection.tier or ""]
+	return {"path": img_path, "found": found, "row": row, "timings": {},
+			"audited": detection.missed is not None, "missed": bool(detection.missed),
+			"tier": detection.tier, "tier_times": {}}
+
+
+def process_image(i, img_path, detector, run_settings):
+	"""
+	This function will detect the OD in one image and save
+	the cropped OD to the output directory (unless the crops
+	are disabled).
+
+	Args:
+		i - int representing the index of the image in the dataset.
+		img_path - string representing the path of the image.
+		detector - detection.ODDetector used for the image.
+		run_settings - dict with the output path, audit rate,
+			reduced decode and crops flags.
+
+	Returns:
+		dict with the result of the image (see save_result).
+	"""
+	audit = bool(run_settings['audit']) and i % run_settings['audit'] == 0
+	try:
+		image, original_size, original_image = load_image(img_path, detector, run_settings)
+	except IOError as e:
+		detector.timer.pop()
+		return failed_result(img_path, e)
+	detection = detector.detect(image, audit=audit, original_size=original_size)
+	del image
+	result = save_result(img_path, detection, original_size, original_image, detector, run_settings)
+	result["timings"] = detector.timer.pop()
+	if run_settings['cascade'] is not None:
+		result["tier_times"] = detector.tier_timer.pop()
+	return result
+
+
+def process_batch(tasks, detector, run_settings):
+	"""
+	This function will detect the OD in a batch of images
+	at once (see detection.ODDetector.detect_batch) and
+	save the results of each one.
+
+	Args:
+		tasks - list of (i, img_path) tuples (see process_image).
+		detector - detection.ODDetector used for the images.
+		run_settings - dict with the run settings.
+
+	Returns:
+		List of dicts with the results of the images (the
+		stage times of the batch are split evenly over them),
+		the ones that could not be read go first (see
+		failed_result).
+	"""
+	if len(tasks) == 1:
+		return [process_image(tasks[0][0], tasks[0][1], detector, run_settings)]
+
+	# The images that can not be read are left out of the batch
+	failed, read, loaded = [], [], []
+	for (i, img_path) in tasks:
+		try:
+			loaded.append(load_image(img_path, detector, run_settings))
+			read.append((i, img_path))
+		except IOError as e:
+			failed.append(failed_result(img_path, e))
+	if not read:
+		detector.timer.pop()
+		return failed
+
+	audit = run_settings['audit']
+	audits = [bool(audit) and i % audit == 0 for (i, _) in read]
+	detections = detector.detect_batch([image for (image, _, _) in loaded], audits,
+									   [size for (_, size, _) in loaded])
+	results = [save_result(img_path, detection, original_size, original_image, detector, run_settings)
+			   for (_, img_path), detection, (_, original_size, original_image) in zip(read, detections, loaded)]
+
+	timings = {name: seconds/len(read) for name, seconds in detector.timer.pop().items()}
+	tier_times = {}
+	if run_settings['cascade'] is not None:
+		tier_times = {name: seconds/len(read) for name, seconds in detector.tier_timer.pop().items()}
+	for result in results:
+		result["timings"] = timings
+		result["tier_times"] = tier_times
+	return failed + results
 
 
 # Main program here 
@@ -52,11 +364,16 @@ if __name__== "__main__":
 	root_path = files.abspath(arguments['ROOT'])
 	out_path = files.abspath(arguments['OUTPUT'])
 	pca_path = files.abspath(arguments['PCA'])
+	jobs = int(arguments['--jobs'])
+	batch = int(arguments['--batch'])
 
 	# For now, just print out settings and  all the images in the root.
 	print(Fore.BLUE + "Settings passed: ")
 	print("Root directory........ %s" % root_path)
-	print("Output directory...... %s\n" % out_path)
+	print("Output directory...... %s" % out_path)
+	print("Worker processes...... %d" % jobs)
+	print("Batch size............ %d" % batch)
+	print("Threads per image..... %s\n" % arguments['--threads'])
 
 	# Check that both directories exist
 	if os.path.lexists(out_path) and os.path.lexists(root_path):
@@ -76,229 +393,158 @@ if __name__== "__main__":
 	images = files.get_images(root_path) # Note line below resets the blue 
 	print(Style.RESET_ALL + Fore.GREEN + "Number of images in the path: {:d}".format(len(images)))
 
-	# Create the correlation array
-	N = 450 # N is the square size of the image (make sure matches PCA sections)
-	corr_array = np.zeros((N,N))
-
-	# Settings (window size)
-	width, height = 30, 30
-
-	# Create the circular mask (from the center) to remove
-	# the iamge circular boarders.
-	Xs = np.ones((N,N))*np.arange(N)
-	Ys = Xs.T
-	r = 180 # Radius (from center) in pixels
-	s = np.floor(N/2) # Displacement
-	Xs, Ys = Xs - s, Ys - s
-	Dist = Xs*Xs + Ys*Ys
-	mask = Dist < r**2
-
-	#############################################################
-	# Params for fitting the curve to the image and displaying it
-	max_weight = 5 # Max weights of points (0-max)
-	Xs = np.linspace(0, 450, 2000) # The linspace X for drawing line
-
-	# The hypothesis function 
-	def func(x, a, b, c): # So we can fit a parabola 
-		return a*x**2 + b*x + c
+	# Detection settings (shared with the workers, see
+	# detection.ODDetector for the rest of the defaults)
+	settings = {
+		"N": 450,            # Square size of the image (make sure matches PCA sections)
+		"window": (30, 30),  # (height, width) of the sliding window
+		"stride": 5,         # Sliding step
+		"cast": not arguments['--no-cast'],
+		"robust": arguments['--robust-fit'],
+		"kmeans": arguments['--kmeans'],
+		"points": arguments['--points'],
+		"localiser": None if arguments['--localiser'] == "none" else arguments['--localiser'],
+		"threads": int(arguments['--threads']),
+		"timing": arguments['--timing'],
+
+		# Pyramid search settings
+		"pyramid": arguments['--pyramid'],
+		"levels": int(arguments['--levels']),
+		"top_k": int(arguments['--top-k']),
+	}
+	run_settings = {"out_path": out_path, "audit": int(arguments['--audit']),
+					"reduced": arguments['--reduced'], "crops": not arguments['--no-crops'],
+					"cascade": float(arguments['--confidence']) if arguments['--cascade'] else None}
+	audited, missed = 0, 0 # Coarse misses of the full scan maximum
+	unreadable = [] # Images that could not be read (not journaled)
+	tiers, tier_times = {}, {} # Images resolved by and seconds spent in each cascade tier
+
+	# Skip the images completed by a previous run (unless forced)
+	journal_path = files.append_path(out_path, JOURNAL)
+	completed = set() if arguments['--force'] else load_journal(journal_path)
+	tasks = [(i, img_path) for i, img_path in enumerate(images) if signature(img_path) not in completed]
+	print("Images already done... {:d}".format(len(images) - len(tasks)))
+
+	# Open the journal (new one if forced) so each image is recorded when done
+	new_journal = arguments['--force'] or not os.path.isfile(journal_path)
+	journal_file = open(journal_path, "w" if new_journal else "a", newline="")
+	journal = csv.writer(journal_file)
+	if new_journal:
+		journal.writerow(["name", "size", "mtime_ns"])
+
+	# Same for the results file (a new one goes with a new journal),
+	# without the old rows of the images done again
+	results_path = files.append_path(out_path, RESULTS)
+	new_results = new_journal or not os.path.isfile(results_path)
+	if not new_results:
+		drop_results(results_path, set(os.path.basename(img_path) for (_, img_path) in tasks))
+	results_file = open(results_path, "w" if new_results else "a", newline="")
+	results_csv = csv.writer(results_file)
+	if new_results:
+		results_csv.writerow(RESULTS_HEADER)
+
+	# Stage times summary and trace of each image (--timing)
+	summary, trace_file = tm.Summary(), None
+	if settings["timing"]:
+		trace_file = open(files.append_path(out_path, TRACE), "w")
 
 	# Loading all the images in the path and detecting the OD in them
-	for i, img_path in enumerate(images):
-		if i > 129 :
-			original_image = ut.read_image(img_path, "BGR2GRAY")
-			original_size = original_image.shape[0:2] # Stores the original size for later
-			S = 450 # the square size of the image
-
-			# Resize the image (with dims (450,450))
-			img_resized = cv2.resize(original_image, (S,S), cv2.INTER_AREA)
-			masked_img = img_resized*mask
-
-			# Sliding algorithm (y,x is the center pixel)
-			offset = np.max([width, height])//2 + 2 # The offset from the boarders
-			for y in range(offset, N-offset, 5):
-			    for x in range(offset, N-offset, 5):
-			        
-			        # Tuples to represent the window box
-			        starts = np.array([y-height/2, x-width/2], dtype=int)
-			        stops = np.array([starts[0]+height, starts[1]+width], dtype=int)
-			        
-			        window = masked_img[starts[0]:stops[0], starts[1]:stops[1]]
-
-			        # PCA reconstruction
-			        weights = np.dot(np.ravel(window), PCA)
-			        recons = np.sum(weights*PCA, axis=1).astype("uint8")
-			        
-			        # Set the value of the comparing matrix
-			        corr_array[y,x] = cv2.matchTemplate(recons.reshape(height,width), window, cv2.TM_CCOEFF)
-
-			# Normalise the array
-			corr_array[corr_array < 0] = 0 # Threshold by 0
-			cv2.normalize(corr_array, corr_array, 0, 255, cv2.NORM_MINMAX)
-
-			# Apply mask
-			corr_array *= mask
-
-			##########################
-			###### Line Fitting ######
-			##########################
-			cv2.normalize(corr_array, corr_array, 0, max_weight, cv2.NORM_MINMAX)
-			corr_array = np.round(corr_array)
-			points = np.empty((2,0), dtype=int)
-
-			for w in range(1, max_weight):
-			    # Corresponding layer in depth matrix is bool repr.
-			    # corresponding weight locations
-			    coords = np.vstack(np.where(corr_array == w))
-			    points = np.hstack((points, np.repeat(coords, w, axis=1)))
-
-			# Fit the line parameters and get new Ys (based on the Xs)
-			params, ppcov = curve_fit(func, points[0,:], points[1,:])
-			b, c, d = params
-			Ys = b*Xs**2 + c*Xs + d
-
-			# Clip the lines (so we dont go off the img)
-			points = np.vstack((Xs, Ys))
-			x_clip = np.logical_or(Xs < 20, Xs > 420)
-			y_clip = np.logical_or(Ys < 20, Xs > 420)
-			clip = np.logical_not(np.logical_or(x_clip, y_clip))
-
-			# Get the extrema (in resized)
-			ext_y = -c/(2*b) 
-			ext_x = b*ext_y**2 + c*ext_y + d
-
-			# Multiply by the scalling factor
-			factors = (original_size[0]/450, original_size[1]/450)
-			#ext_x *= factors[1]
-			#ext_y *= factors[0]
-			# Maybe Change
-			# original_size = (height, width), factors = (height, width)
-
-
-
-			# Draw circle in the od 
-			#cv2.circle(img_resized,(ext_x,ext_y), 10, (255,0,0), -1)
-
-			################################
-			## Getting the ROI for the OD ##
-			################################
-			# Get the initial region corner points
-			size = S/2.5
-			region_x1, region_y1 = int(max(ext_x - size/2, 0)), int(max(ext_y - size/2,0))
-			region_x2, region_y2 = int(min(ext_x + size/2, S)), int(min(ext_y + size/2, S))
-
-			# Get the region obtained (centered at the OD location we found
-			# previosuly). The size of this region can be cahnged, but so far 
-			# this size contains about 1/4 of the image area.
-			region = img_resized[region_y1:region_y2,region_x1:region_x2]
-			Z = region.reshape((-1))
-
-			# Convert to np.float32 for the K-Means
-			Z = np.float32(Z)
-
-			# min od size
-			od_size = 100
-
-
-			try: 
-				print("image: {}".format(i))
-				# Define criteria, stop when threshold is reached or the max iter is reached
-				criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
-				K = 4 # Nubers of clusters
-
-				# Perform K-Means with OpenCV's function
-				ret,label,center=cv2.kmeans(Z,K,None,criteria,10,cv2.KMEANS_RANDOM_CENTERS)
-
-				# Now convert back into uint8, and make original image
-				center = np.uint8(center)
-				res = center[label.flatten()]
-				k_means_region = res.reshape((img_resized[region_y1:region_y2,region_x1:region_x2].shape))
-
-				# Apply the erosion 
-				kernel = np.ones((7,7),np.uint8)
-				erosion = cv2.erode(k_means_region,kernel,iterations = 1)
-
-				###################################
-				## Gaussian Mixture Models Stuff ##
-				###################################
-
-				# Get the maximum value of the erosion 
-				m_colour = np.max(erosion)
-
-				# Get the location of these points (Equivalent to I)
-				Ys, Xs = np.where(erosion==m_colour)
-
-				# First col is Ys, second col is Xs
-				samples = np.vstack((Ys,Xs)).T
-
-				# Cluster those points with GMM
-				od_prob = GMM(n_components=1, covariance_type="diag")
-				od_prob.fit(samples)
-
-				# Get the scores for each sample in the GMM
-				scores = od_prob.score_samples(samples)
-				# Mean and std_dev for threshold calc
-				mean = np.mean(scores)
-				std = np.sqrt(np.var(scores))
-				thresh = 1.5 # std_dev unit for threshol 
-
-				# Apply the mask to the 
-				filtered = scores > mean - 2*std
-				locations = np.where(filtered)
-
-				# The (x,y) in I which are within the threshold 
-				rows = samples[locations]
-
-				# get the remaining tuples in I
-				Ys, Xs = rows[:, 0], rows[:, 1]
-
-				# Create a dummy matrix to represent the data (0s everywhere,
-				# except in the remaining (x,y)) 
-				detected = np.zeros(erosion.shape, dtype="uint8")
-				detected[Ys, Xs] = 255
-
-				# Get the ROI corners
-				rect = an.get_rect(detected) #(x1, y1, x2, y2)
-				x1 = rect[0]; y1 = rect[1];
-				x2 = rect[2]; y2 = rect[3];
-
-				if x2-x1 < od_size:
-					compensate = od_size - (x2-x1)
-					x1 = int(max(0, x1-compensate/2))
-					x2 = int(min(450, x2+compensate/2))
-				if y2-y1 < od_size:
-					compensate = od_size - (y2-y1)
-					y1 = int(max(0, y1-compensate/2))
-					y2 = int(min(450, y2+compensate/2))
-
-			except:
-				x1, y1 = int(max(ext_x - od_size/2, 0)), int(max(ext_y - od_size/2,0))
-				x2, y2 = int(min(ext_x + od_size/2, S)), int(min(ext_y + od_size/2, S))
-
-			# Get the original positions now
-			x1 = int((region_x1 + x1)*factors[0]); y1 = int((region_y1 + y1)*factors[1])
-			x2 = int((region_x1 + x2)*factors[0]); y2 = int((region_y1 + y2)*factors[1])
-
-			# Now we save the OD
-			od = original_image[y1:y2,x1:x2]
-			cv2.imwrite(files.append_path(out_path, files.get_filename(img_path)+".jpg"), od)
-
-
-			# Saving the figure and the line
-			#my_dpi = 96 # DPA of YOUR monitor (for exact size)
-			#fig = plt.figure(figsize=(800/my_dpi, 800/my_dpi), dpi=my_dpi)
-			#ax = plt.gca()
-			#ax.set_axis_off()
-			#ax.imshow(img, cmap="gray")
-			#ax.plot(Ys[clip], Xs[clip], color="blue")
-			#fig.tight_layout(); 
-			#plt.savefig(files.append_path(out_path, files.get_filename(img_path)+".jpg"), dpi=my_dpi)
-
-			# Progress bar stuff
+	# (a batch of images at a time)
+	batches = [tasks[k:k+batch] for k in range(0, len(tasks), batch)]
+	pool = None
+	if jobs > 1:
+		# Share the PCA matrix with the workers instead of pickling it
+		shared_PCA = RawArray("d", PCA.size)
+		np.frombuffer(shared_PCA)[:] = PCA.ravel()
+		pool = Pool(jobs, init_worker, (shared_PCA, PCA.shape, settings, run_settings))
+		batch_results = pool.imap_unordered(worker_task, batches)
+	else:
+		detector = make_detector(PCA, settings, run_settings['cascade'])
+		batch_results = (process_batch(chunk, detector, run_settings) for chunk in batches)
+	results = (result for chunk in batch_results for result in chunk)
+
+	start, finished = time.time(), False
+	try:
+		for done, result in enumerate(results, 1):
+			if "error" in result:
+				print(Fore.RED + "\n{}: {}".format(result["error"], result["path"]) + Style.RESET_ALL)
+				unreadable.append(result["path"])
+			elif not result["found"]:
+				print(Fore.RED + "\nNo OD found in {}".format(result["path"]) + Style.RESET_ALL)
+			audited += result["audited"]
+			missed += result["missed"]
+			if result["tier"] is not None:
+				tiers[result["tier"]] = tiers.get(result["tier"], 0) + 1
+			for name, seconds in result["tier_times"].items():
+				tier_times[name] = tier_times.get(name, 0.0) + seconds
+
+			# Record the image in the journal straight away (after
+			# its results, so a journaled image always has them)
+			if "error" not in result:
+				if trace_file is not None:
+					summary.add(result["timings"])
+					stages = {name: round(1000*seconds, 3) for name, seconds in result["timings"].items()}
+					trace_file.write(json.dumps({"name": result["row"][0], "stages_ms": stages}) + "\n")
+				results_csv.writerow(result["row"])
+				results_file.flush()
+				journal.writerow(signature(result["path"]))
+				journal_file.flush()
+
+			# Progress bar stuff (with the combined throughput)
 			cmd_size = 20 # Length of the loading bar in chars
-			perc = (i+1)/len(images)	
+			perc = done/len(tasks)
 			bar = int(np.round(perc*cmd_size))
 			line = "Processing ["
 			line += "="*bar + " "*(cmd_size-bar)
-			line += "] {:d}%".format(int(np.round(perc*100)))
+			line += "] {:d}% ({:.2f} images/sec)".format(int(np.round(perc*100)), done/(time.time()-start))
 			ut.update_line(line) # Thins func will use carriage return
+		finished = True
+	finally:
+		journal_file.close()
+		results_file.close()
+		if trace_file is not None:
+			trace_file.close()
+		if pool is not None:
+			# On an error (or Ctrl-C) the queued batches are not
+			# waited for, their results could not be recorded
+			if finished:
+				pool.close()
+			else:
+				pool.terminate()
+			pool.join()
+		else:
+			detector.close() # Threads of the row bands
 	print("\nFinished processing.")
+	if unreadable:
+		print(Fore.RED + "Could not read {:d} images, they are tried again on the next run.".format(
+			len(unreadable)) + Style.RESET_ALL)
+
+	# Where the time went
+	if settings["timing"]:
+		print(Fore.BLUE + "Stage times:" + Style.RESET_ALL)
+		print(summary.table())
+
+	# Report how good the coarse stage was
+	if settings["pyramid"] and audited:
+		print("Coarse top-{:d} missed the full scan maximum in {:d} of {:d} audited images ({:.1f}%).".format(
+			settings["top_k"], missed, audited, 100*missed/audited))
+
+	# How many images each cascade tier resolved, and the time
+	# saved against running the full detector on all of them
+	if run_settings['cascade'] is not None and tiers:
+		total, reached = sum(tiers.values()), sum(tiers.values())
+		print(Fore.BLUE + "Cascade tiers (confidence >= {:.2f}):".format(run_settings['cascade']) + Style.RESET_ALL)
+		for name, seconds in tier_times.items(): # In cascade order
+			count = tiers.get(name, 0)
+			print("{:.<22} {:d} images ({:.1f}%), {:.1f} ms/image".format(
+				name, count, 100*count/total, 1000*seconds/reached))
+			reached -= count # Images left for the next tiers
+
+		# The full detector is the last tier (see ODCascade.from_settings)
+		if tiers.get("full"):
+			full = total*tier_times["full"]/tiers["full"]
+			saved = full - sum(tier_times.values())
+			print("Time saved............ {:.1f} s ({:.0f}% of the full detector on every image)".format(
+				saved, 100*saved/full))
+		else:
+			print("Time saved............ unknown (no image reached the full detector)")
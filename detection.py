@@ -0,0 +1,1482 @@
+# File containing the optic disc (OD)
+# detection code used by detect_od.py,
+# such as the PCA sliding window stuff.
+import cv2
+import numpy as np
+import utilities as ut
+import timing as tm
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.stride_tricks import as_strided
+
+
+def window_centres(N, size, stride):
+	"""
+	This function will return the centre positions
+	visited by the sliding window along one axis
+	of the image (same positions as the old loop).
+
+	Args:
+		N - int representing the length of the axis.
+		size - (height, width) tuple of the window.
+		stride - int representing the step between windows.
+
+	Returns:
+		Numpy array with the centre positions.
+	"""
+
+	# The offset from the boarders
+	offset = np.max(size)//2 + 2
+	return np.arange(offset, N-offset, stride)
+
+
+def _strided_windows(image, size, rows, cols):
+	"""
+	Returns a (rows, cols, height, width) view of the
+	windows centred at the given positions. No data
+	is copied here, so do not write into it.
+	"""
+	height, width = size
+	step_y = rows[1]-rows[0] if len(rows) > 1 else 1
+	step_x = cols[1]-cols[0] if len(cols) > 1 else 1
+
+	# Top left corner of the first window
+	base = image[rows[0]-height//2:, cols[0]-width//2:]
+	s_y, s_x = base.strides
+	shape = (len(rows), len(cols), height, width)
+	return as_strided(base, shape, (step_y*s_y, step_x*s_x, s_y, s_x), writeable=False)
+
+
+def _map_blocks(function, starts, pool=None):
+	"""
+	Calls the function with each start (of a block or band),
+	in order or on the pool (concurrent.futures executor).
+	"""
+	if pool is None:
+		for start in starts:
+			function(start)
+	else:
+		list(pool.map(function, starts)) # Also raises the errors
+
+
+def pca_projection(image, PCA, size, stride, block=64, pool=None):
+	"""
+	This function will calculate the PCA coefficients
+	of every sliding window in the image. The windows
+	(a strided view, no copy) are projected with one
+	np.dot against the components per block of windows,
+	so only the sampled windows are computed (a filter
+	bank would correlate every pixel and keep 1 in
+	stride^2 of them). The blocks keep their float
+	copies in the cache. The blocks are row bands of the
+	window grid, so they can run on a thread pool.
+
+	Args:
+		image - numpy array representing the (masked) grey image.
+		PCA - numpy array (height*width, K) with the components.
+		size - (height, width) tuple of the window.
+		stride - int representing the step between windows.
+		block - int, number of windows per multiply.
+		pool - concurrent.futures executor used to project the
+			blocks in parallel, None to project them in order.
+
+	Returns:
+		(rows, cols, coeffs) tuple, where rows and cols are the
+		window centres and coeffs has shape (rows, cols, K).
+	"""
+	height, width = size
+	rows = window_centres(image.shape[0], size, stride)
+	cols = window_centres(image.shape[1], size, stride)
+	windows = _strided_windows(image, size, rows, cols).reshape(-1, height*width)
+
+	coeffs = np.empty((len(windows), PCA.shape[1]))
+	def project_block(start):
+		coeffs[start:start+block] = np.dot(np.float64(windows[start:start+block]), PCA)
+	_map_blocks(project_block, range(0, len(windows), block), pool)
+
+	return rows, cols, coeffs.reshape(len(rows), len(cols), PCA.shape[1])
+
+
+def local_sums(image, size, rows, cols):
+	"""
+	This function will return the sum and the sum of
+	squares of the pixels in every window centred at
+	the given rows and cols (box filters, no loops).
+
+	Args:
+		image - numpy array representing the (masked) grey image.
+		size - (height, width) tuple of the window.
+		rows, cols - numpy arrays with the window centres.
+
+	Returns:
+		(S1, S2) tuple of arrays with shape (rows, cols).
+	"""
+	height, width = size
+	anchor = (width//2, height//2)
+	source = np.float64(image)
+
+	# Unnormalised box filters give the window sums
+	box = lambda x : cv2.boxFilter(x, -1, (width, height), anchor=anchor,
+								   normalize=False, borderType=cv2.BORDER_CONSTANT)
+	S1 = box(source)[np.ix_(rows, cols)]
+	S2 = box(source*source)[np.ix_(rows, cols)]
+	return S1, S2
+
+
+def score_map(image, PCA, size, stride=1, normed=False, pool=None):
+	"""
+	This function will calculate the TM_CCOEFF score between
+	every window and its PCA reconstruction in closed form.
+	As the components are orthonormal, with R = PCA*c:
+
+		sum(R*W) = c.c    and    sum(R) = sum(PCA, axis=0).c
+
+	so the score only needs the coefficient maps and the
+	local window sums. Note that the reconstruction is NOT
+	cast to uint8 here (see correlation_map for that).
+
+	Args:
+		image - numpy array representing the (masked) grey image.
+		PCA - numpy array (height*width, K) with orthonormal components.
+		size - (height, width) tuple of the window.
+		stride - int representing the step between windows.
+		normed - bool, return TM_CCOEFF_NORMED instead (uses the
+			local sum of squares).
+		pool - executor for the projection (see pca_projection).
+
+	Returns:
+		Numpy array (same shape as image) with the scores set
+		at the window centres and 0s everywhere else.
+	"""
+	height, width = size
+	n = height*width
+	rows, cols, coeffs = pca_projection(image, PCA, size, stride, pool=pool)
+	S1, S2 = local_sums(image, size, rows, cols)
+
+	# Closed form of sum(R*W) - sum(R)*sum(W)/n
+	energy = np.sum(coeffs*coeffs, axis=2)
+	recons_sum = np.dot(coeffs, np.sum(PCA, axis=0))
+	scores = energy - recons_sum*S1/n
+
+	if normed:
+		# sqrt(sum((R-mean)^2)*sum((W-mean)^2)), 0 on flat windows
+		denom = np.sqrt(np.maximum(energy - recons_sum**2/n, 0)*np.maximum(S2 - S1**2/n, 0))
+		scores = np.divide(scores, denom, out=np.zeros_like(scores), where=denom > 0)
+
+	corr_array = np.zeros(image.shape)
+	corr_array[np.ix_(rows, cols)] = scores
+	return corr_array
+
+
+def correlation_map(image, PCA, size, stride, cast=True, pool=None):
+	"""
+	This function will calculate the correlation array
+	between every sliding window and its PCA reconstruction
+	(cv2.TM_CCOEFF), with the windows projected and rebuilt
+	with matrix multiplies (see batch_correlation_maps).
+
+	Args:
+		image - numpy array representing the (masked) grey image.
+		PCA - numpy array (height*width, K) with the components.
+		size - (height, width) tuple of the window.
+		stride - int representing the step between windows.
+		cast - bool, cast the reconstructions to uint8 like the
+			original loop. If False the closed form score_map
+			is used instead (no reconstructions at all).
+		pool - executor for the row bands (see batch_correlation_maps).
+
+	Returns:
+		Numpy array (same shape as image) with the scores set
+		at the window centres and 0s everywhere else.
+	"""
+	if not cast:
+		return score_map(image, PCA, size, stride, pool=pool)
+	return batch_correlation_maps([image], PCA, size, stride, cast, pool=pool)[0]
+
+
+def batch_correlation_maps(images, PCA, size, stride, cast=True, block=64, pool=None):
+	"""
+	This function will calculate the correlation arrays of
+	several images at once (same result as correlation_map,
+	up to rounding). The windows of all the images are
+	stacked into one (B*windows, height*width) matrix and
+	projected with matrix multiplies against the PCA
+	instead of one filter bank per image. The stack is
+	processed in blocks of rows, so the float copies and
+	reconstructions of a block stay in the cache (the
+	whole stack at once is memory bound). The blocks are
+	row bands of the window grid, so they can be scored in
+	parallel by a thread pool (NumPy releases the GIL in
+	the multiplies and casts).
+
+	Args:
+		images - list of numpy arrays with the (masked) grey
+			images, all of them with the same shape.
+		PCA - numpy array (height*width, K) with the components.
+		size - (height, width) tuple of the window.
+		stride - int representing the step between windows.
+		cast - bool, cast the reconstructions to uint8 (if False
+			score_map is used for each image instead).
+		block - int, number of windows (rows) per multiply.
+		pool - concurrent.futures executor used to score the
+			blocks in parallel, None to score them in order (also
+			used by score_map).
+
+	Returns:
+		List of numpy arrays (one per image) with the scores
+		set at the window centres and 0s everywhere else.
+	"""
+	if not cast:
+		# The closed form does not need the reconstructions
+		return [score_map(image, PCA, size, stride, pool=pool) for image in images]
+
+	height, width = size
+	rows = window_centres(images[0].shape[0], size, stride)
+	cols = window_centres(images[0].shape[1], size, stride)
+
+	# Every window of every image as a row (the memory used
+	# grows with the number of images, see the batch size)
+	windows = np.concatenate([_strided_windows(image, size, rows, cols).reshape(-1, height*width)
+							  for image in images])
+	scores = np.empty(len(windows))
+	def score_block(start):
+		rows_block = np.float64(windows[start:start+block])
+		coeffs = np.dot(rows_block, PCA)
+		scores[start:start+block] = _ccoeff(coeffs, rows_block, PCA, cast)
+
+	_map_blocks(score_block, range(0, len(windows), block), pool)
+	scores = scores.reshape(len(images), len(rows), len(cols))
+
+	# Split the scores back per image
+	corr_arrays = []
+	for image, image_scores in zip(images, scores):
+		corr_array = np.zeros(image.shape)
+		corr_array[np.ix_(rows, cols)] = image_scores
+		corr_arrays.append(corr_array)
+	return corr_arrays
+
+
+def _ccoeff(coeffs, windows, PCA, cast):
+	"""
+	Returns the TM_CCOEFF scores of flattened float64 windows
+	(M, n) against their PCA reconstructions given the
+	coefficients. The sums of the uint8 values are integers
+	well under 2^53, so they are exact as float64 (and the
+	row sums can be BLAS products with a vector of ones).
+	"""
+	n = windows.shape[1]
+	ones = np.ones(n)
+	if not cast:
+		# Same closed form as score_map
+		energy = np.sum(coeffs*coeffs, axis=1)
+		return energy - np.dot(coeffs, np.sum(PCA, axis=0))*np.dot(windows, ones)/n
+
+	# PCA reconstruction of each window (uint8 like before)
+	recons = np.float64(np.dot(coeffs, PCA.T).astype("uint8"))
+
+	# TM_CCOEFF = sum(R*W) - sum(R)*sum(W)/n for same sized pairs
+	scores = np.einsum("ij,ij->i", recons, windows)
+	return scores - np.dot(recons, ones)*np.dot(windows, ones)/n
+
+
+def window_scores(image, PCA, size, rows, cols, cast=True):
+	"""
+	This function will calculate the correlation scores
+	(same as correlation_map) only for the windows centred
+	at the given rows and cols. This is cheaper than the
+	filter bank when only a small part of the image is
+	needed (e.g. refining around a few peaks).
+
+	Args:
+		image - numpy array representing the (masked) grey image.
+		PCA - numpy array (height*width, K) with the components.
+		size - (height, width) tuple of the window.
+		rows, cols - evenly spaced numpy arrays with the centres.
+		cast - bool, cast the reconstructions to uint8.
+
+	Returns:
+		Numpy array with shape (rows, cols) with the scores.
+	"""
+	height, width = size
+	windows = np.float64(_strided_windows(image, size, rows, cols).reshape(-1, height*width))
+	coeffs = np.dot(windows, PCA)
+	return _ccoeff(coeffs, windows, PCA, cast).reshape(len(rows), len(cols))
+
+
+def scale_components(PCA, size, factor):
+	"""
+	This function will downscale the principal components
+	by the given factor so they can be used on a pyramid
+	level. The resized components are orthonormalised
+	again (QR), which the closed form scores rely on.
+
+	Args:
+		PCA - numpy array (height*width, K) with the components.
+		size - (height, width) tuple of the window.
+		factor - int representing the downscaling factor.
+
+	Returns:
+		(PCA, size) tuple with the scaled components and window size.
+	"""
+	height, width = size
+	small = (max(height//factor, 1), max(width//factor, 1))
+
+	# Resize each component as if it was an image
+	resize = lambda v : cv2.resize(v.reshape(height, width), (small[1], small[0]),
+								   interpolation=cv2.INTER_AREA).ravel()
+	scaled = np.vstack([resize(PCA[:, j]) for j in range(PCA.shape[1])]).T
+
+	# Orthonormalise the scaled components
+	Q, _ = np.linalg.qr(scaled)
+	return Q, small
+
+
+def _top_peaks(scores, k, spacing):
+	"""
+	Returns the (row, col) of the k highest values of scores,
+	suppressing anything within spacing of a chosen peak.
+	"""
+	scores = scores.copy()
+	peaks = []
+	for _ in range(k):
+		y, x = np.unravel_index(np.argmax(scores), scores.shape)
+		if scores[y, x] <= 0:
+			break
+		peaks.append((y, x))
+		scores[max(y-spacing, 0):y+spacing+1, max(x-spacing, 0):x+spacing+1] = 0
+	return peaks
+
+
+def pyramid_map(image, PCA, size, stride, levels=1, top_k=5, radius=None, mask=None, cast=True,
+				seeds=None, pool=None):
+	"""
+	This function will calculate the correlation array with a
+	coarse to fine search. The closed form scores are calculated
+	on a downsampled (cv2.pyrDown) image with scaled components,
+	then the full resolution scores are calculated only around
+	the top_k coarse peaks. Everywhere else the (upsampled) coarse
+	scores are used (scaled to match the refined ones), so the
+	map can still be used for the fitting.
+
+	Args:
+		image - numpy array representing the (masked) grey image.
+		PCA - numpy array (height*width, K) with the components.
+		size - (height, width) tuple of the window.
+		stride - int representing the step between windows.
+		levels - int representing the number of pyramid levels.
+		top_k - int representing the number of peaks to refine.
+		radius - int, half size of the refined areas (in pixels of
+			the image). Defaults to the largest window side.
+		mask - optional bool array, peaks are only taken inside it.
+		cast - bool, cast the full resolution reconstructions to uint8.
+		seeds - optional list of (y, x) positions (pixels of the
+			image) refined instead of the coarse peaks, e.g. the
+			bright_candidates.
+		pool - concurrent.futures executor for the coarse scores
+			(see pca_projection) and the refined areas (one task
+			each), None to do them in order.
+
+	Returns:
+		(corr_array, peaks) tuple, where corr_array is the same as
+		correlation_map's and peaks is the list of refined (y, x).
+	"""
+	factor = 2**levels
+	radius = np.max(size) if radius is None else radius
+
+	# Coarse scores (dense at the pyramid level)
+	small = image
+	for _ in range(levels):
+		small = cv2.pyrDown(small)
+	small_PCA, small_size = scale_components(PCA, size, factor)
+	coarse = score_map(small, small_PCA, small_size, pool=pool)
+	if mask is not None:
+		small_mask = cv2.resize(np.uint8(mask), (small.shape[1], small.shape[0]),
+								interpolation=cv2.INTER_NEAREST)
+		coarse *= small_mask
+
+	# Closest coarse score for each full resolution window
+	rows = window_centres(image.shape[0], size, stride)
+	cols = window_centres(image.shape[1], size, stride)
+	c_rows = np.minimum(np.round(rows/factor).astype(int), small.shape[0]-1)
+	c_cols = np.minimum(np.round(cols/factor).astype(int), small.shape[1]-1)
+	grid = coarse[np.ix_(c_rows, c_cols)]
+
+	# Refine at full resolution around the coarse peaks
+	peaks = []
+	fine = np.zeros(grid.shape)
+	refined = np.zeros(grid.shape, dtype=bool)
+	if seeds is None:
+		seeds = [(y*factor, x*factor) for (y, x) in _top_peaks(coarse, top_k, max(small_size))]
+	areas = []
+	for (y, x) in seeds:
+		near_rows = np.abs(rows - y) <= radius
+		near_cols = np.abs(cols - x) <= radius
+		if not np.any(near_rows) or not np.any(near_cols):
+			continue
+		areas.append((near_rows, near_cols))
+		peaks.append((y, x))
+
+	score_area = lambda area: window_scores(image, PCA, size, rows[area[0]], cols[area[1]], cast)
+	area_scores = map(score_area, areas) if pool is None else pool.map(score_area, areas)
+	for (near_rows, near_cols), scores in zip(areas, area_scores):
+		fine[np.ix_(near_rows, near_cols)] = scores
+		refined[np.ix_(near_rows, near_cols)] = True
+
+	# Bring the coarse scores to the fine scale (least squares on
+	# the refined windows, or just the pixel count ratio)
+	scale = np.prod(size)/np.prod(small_size)
+	if np.any(grid[refined]):
+		scale = np.sum(fine[refined]*grid[refined])/np.sum(grid[refined]**2)
+
+	corr_array = np.zeros(image.shape)
+	corr_array[np.ix_(rows, cols)] = np.where(refined, fine, grid*scale)
+	return corr_array, peaks
+
+
+def fit_parabola(weights, max_weight, robust=False, threshold=2.5, iterations=5):
+	"""
+	This function will fit the parabola x = a*y^2 + b*y + c
+	(x are the columns, y the rows) to the points of a weight
+	map by weighted least squares. This is the same fit as
+	curve_fit on the points repeated w times, but in closed
+	form and without repeating anything. Like before, only
+	the weights 1 to max_weight-1 are used.
+
+	Args:
+		weights - numpy array with the (rounded) weight map.
+		max_weight - int, weights >= max_weight are ignored.
+		robust - bool, iteratively drop the points with residuals
+			above threshold times the robust (MAD) deviation,
+			e.g. stray vessel responses far from the arcade.
+		threshold - float, rejection threshold for the robust mode.
+		iterations - int, max number of robust iterations.
+
+	Returns:
+		Numpy array with the (a, b, c) parameters.
+	"""
+	ys, xs = np.nonzero((weights >= 1) & (weights < max_weight))
+	w = weights[ys, xs].astype(np.float64)
+	if len(np.unique(ys)) < 3:
+		raise ValueError("Not enough points to fit the parabola.")
+
+	# Design matrix of the quadratic (scaled by sqrt(w))
+	A = np.vstack((ys*ys, ys, np.ones(len(ys)))).T.astype(np.float64)
+	keep = np.ones(len(ys), dtype=bool)
+	for _ in range(iterations if robust else 1):
+		root_w = np.sqrt(w[keep])
+		params = np.linalg.lstsq(A[keep]*root_w[:, None], xs[keep]*root_w, rcond=None)[0]
+		if not robust:
+			break
+
+		# Reject the points far from the current fit
+		residuals = np.abs(xs - np.dot(A, params))
+		deviation = 1.4826*np.median(residuals[keep])
+		new_keep = residuals <= threshold*max(deviation, 1.0)
+		if np.array_equal(new_keep, keep) or len(np.unique(ys[new_keep])) < 3:
+			break
+		keep = new_keep
+
+	return params
+
+
+def parabola_vertex(params):
+	"""
+	Returns the (x, y) vertex of the parabola x = a*y^2 + b*y + c.
+	"""
+	a, b, c = params
+	y = -b/(2*a)
+	return a*y**2 + b*y + c, y
+
+
+def kmeans_histogram(image, K, criteria, centres=None):
+	"""
+	This function will do the same clustering as cv2.kmeans
+	on the intensities of a uint8 image, but on its 256 bin
+	histogram, so each iteration is O(256) whatever the size
+	of the image. The starting centres are the previous
+	centres (warm start, if given) and the K quantiles of the
+	histogram, and the most compact result is kept.
+
+	Args:
+		image - numpy array with uint8 intensities.
+		K - int representing the number of clusters.
+		criteria - cv2.kmeans style (type, max_iter, epsilon) tuple.
+		centres - optional array with K starting centres.
+
+	Returns:
+		(centres, lut) tuple, where lut maps every intensity
+		(0-255) to the index of its cluster.
+	"""
+	hist = np.bincount(image.ravel(), minlength=256).astype(np.float64)
+	levels = np.arange(256, dtype=np.float64)
+	_, max_iter, eps = criteria
+
+	# K quantiles of the intensities as a deterministic start
+	cdf = np.cumsum(hist)/max(np.sum(hist), 1)
+	starts = [np.float64(np.searchsorted(cdf, (np.arange(K)+0.5)/K))]
+	if centres is not None and len(centres) == K:
+		starts.append(np.float64(centres))
+
+	best = None
+	for start in starts:
+		c = start.copy()
+		for _ in range(max_iter):
+			lut = np.argmin(np.abs(levels[:, None] - c[None, :]), axis=1)
+
+			# Weighted mean of each cluster (empty ones stay put)
+			counts = np.bincount(lut, weights=hist, minlength=K)
+			sums = np.bincount(lut, weights=hist*levels, minlength=K)
+			new_c = np.where(counts > 0, sums/np.maximum(counts, 1), c)
+			shift = np.max(np.abs(new_c - c))
+			c = new_c
+			if shift <= eps:
+				break
+
+		lut = np.argmin(np.abs(levels[:, None] - c[None, :]), axis=1)
+		compactness = np.sum(hist*(levels - c[lut])**2)
+		if best is None or compactness < best[0]:
+			best = (compactness, c, lut)
+
+	return best[1], best[2]
+
+
+def gaussian_scores(samples, reg_covar=1e-6):
+	"""
+	This function will return the log-likelihood of each sample
+	under a single Gaussian with diagonal covariance fitted to the
+	samples. It is the closed form of a one component GMM (the
+	mean and the per-axis variance), with the same regularisation
+	as sklearn's GaussianMixture, so no EM iterations are needed.
+
+	Args:
+		samples - (n, d) numpy array with the samples.
+		reg_covar - value added to the variances.
+
+	Returns:
+		(n,) numpy array with the log-likelihoods.
+	"""
+	samples = np.asarray(samples, dtype=np.float64)
+	mean = np.mean(samples, axis=0)
+	var = np.var(samples, axis=0) + reg_covar
+
+	# log N(x | mean, diag(var)) summed over the axes
+	dist = np.sum((samples - mean)**2/var, axis=1)
+	return -0.5*(dist + np.sum(np.log(2*np.pi*var)))
+
+
+def vessel_map(image, mask, kernel, fraction=0.1):
+	"""
+	This function will extract the vessels of the image with
+	a morphological black top-hat (closing minus the image),
+	which responds to the dark structures thinner than the
+	kernel. Only the strongest responses (mostly the main
+	arcade, the widest and darkest vessels) are kept, so the
+	map can be used instead of the correlation array as the
+	points of the parabola fit.
+
+	Args:
+		image - numpy array with the (resized and masked) grey
+			or green channel uint8 image.
+		mask - numpy bool array with the circular mask.
+		kernel - numpy array with the structuring element, it
+			has to be wider than the main vessels.
+		fraction - float, fraction of the mask pixels kept.
+
+	Returns:
+		Numpy float32 array with the top-hat responses, zero
+		outside the kept pixels.
+	"""
+	hat = cv2.morphologyEx(image, cv2.MORPH_BLACKHAT, kernel).astype(np.float32)
+
+	# Away from the mask edge (the black surround is "dark" too)
+	inner = cv2.erode(mask.astype(np.uint8), kernel) > 0
+	hat *= inner
+
+	threshold = np.percentile(hat[inner], 100*(1 - fraction))
+	hat[hat < threshold] = 0
+	return hat
+
+
+def _box_totals(table, size, pad, shape):
+	"""
+	Returns the sums of the size x size boxes centred at every
+	pixel from a summed-area table (cv2.integral) padded by
+	pad on each side (edge values), so the boxes are cut at
+	the image borders and all of them are slices.
+	"""
+	top = pad - size//2
+	rows = lambda start : slice(start, start + shape[0])
+	cols = lambda start : slice(start, start + shape[1])
+	return (table[rows(top + size), cols(top + size)] - table[rows(top), cols(top + size)]
+			- table[rows(top + size), cols(top)] + table[rows(top), cols(top)])
+
+
+def bright_candidates(image, mask, sizes=(30, 45, 60), top_k=5, factor=3, coverage=0.9):
+	"""
+	This function will find the brightest disc sized regions
+	of the image, which are the OD candidates. Every box is
+	scored by its mean brightness minus the mean of the ring
+	around it (a box twice as wide), so large bright areas
+	do not win, and only the pixels inside the mask are
+	counted. The image is downsampled by factor first and
+	all the box sums come from summed-area tables (four
+	slices per box size), so it takes a couple of ms.
+
+	Args:
+		image - numpy array with the (resized and masked) grey image.
+		mask - numpy bool array with the circular mask.
+		sizes - tuple of ints, side of the boxes (resized pixels).
+		top_k - int, max number of candidates.
+		factor - int, downsampling factor (step between the boxes).
+		coverage - float, min fraction of each box inside the mask.
+
+	Returns:
+		List of (x, y, size, score) tuples, best first, with the
+		centre (resized pixels), box size and score of the
+		candidates.
+	"""
+	shape = (image.shape[0]//factor, image.shape[1]//factor)
+	small = cv2.resize(image, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+	small_mask = cv2.resize(np.float32(mask), (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+
+	# Summed-area tables of the pixels and of the mask coverage
+	small_sizes = [max(size//factor, 1) for size in sizes]
+	pad = 2*max(small_sizes)
+	sums = np.pad(cv2.integral(small, sdepth=cv2.CV_64F), pad, "edge")
+	counts = np.pad(cv2.integral(small_mask, sdepth=cv2.CV_64F), pad, "edge")
+	box = lambda table, size : _box_totals(table, size, pad, shape)
+	mean = lambda total, count : total/np.maximum(count, 1e-6)
+
+	best, best_size = np.zeros(shape), np.zeros(shape, dtype=int)
+	for size, small_size in zip(sizes, small_sizes):
+		inner, inner_count = box(sums, small_size), box(counts, small_size)
+		outer, outer_count = box(sums, 2*small_size), box(counts, 2*small_size)
+		score = mean(inner, inner_count) - mean(outer - inner, outer_count - inner_count)
+		score = np.where(inner_count >= coverage*small_size**2, score, 0)
+
+		best_size = np.where(score > best, size, best_size)
+		best = np.maximum(score, best)
+
+	# Back to the resized image (centre of the small pixels)
+	return [(int(x*factor + factor//2), int(y*factor + factor//2), int(best_size[y, x]), float(best[y, x]))
+			for (y, x) in _top_peaks(best, top_k, max(small_sizes))]
+
+
+
+def fit_residual(weights, max_weight, params):
+	"""
+	Returns the weighted RMS distance (columns) of the points
+	of a weight map to the parabola x = a*y^2 + b*y + c, same
+	points and weights as fit_parabola.
+	"""
+	ys, xs = np.nonzero((weights >= 1) & (weights < max_weight))
+	w = weights[ys, xs].astype(np.float64)
+	residuals = xs - (params[0]*ys*ys + params[1]*ys + params[2])
+	return float(np.sqrt(np.sum(w*residuals**2)/np.sum(w)))
+
+
+def map_peaks(score_map, centre, near=30, spacing=60):
+	"""
+	Returns the (local, peak, second) scores of a score map (the
+	masked correlation or vessel map): the best one within near
+	of the centre (the box), the best one of the map and the
+	best one further than spacing from it (see _top_peaks).
+	Negative scores count as 0.
+	"""
+	x, y = int(round(centre[0])), int(round(centre[1]))
+	window = score_map[max(y-near, 0):y+near+1, max(x-near, 0):x+near+1]
+	local = max(float(np.max(window)), 0.0) if window.size else 0.0
+	peaks = [float(score_map[p_y, p_x]) for (p_y, p_x) in _top_peaks(score_map, 2, spacing)]
+	peaks += [0.0]*(2 - len(peaks))
+	return local, peaks[0], peaks[1]
+
+
+def candidate_peaks(candidates, centre, near=30):
+	"""
+	Same as map_peaks for the bright_candidates (the peaks of
+	the brightness score map), best first.
+	"""
+	scores = [score for (_, _, _, score) in candidates] + [0.0, 0.0]
+	local = [score for (x, y, _, score) in candidates
+			 if abs(x - centre[0]) <= near and abs(y - centre[1]) <= near]
+	return max(local + [0.0]), scores[0], scores[1]
+
+
+def detection_confidence(peaks, residual=None, residual_scale=200):
+	"""
+	This function will rate how much a detection can be trusted,
+	from 0 to 1, out of the map the detector used (correlation,
+	vessel or brightness map). It is the product of three terms:
+		support - local/peak, 1 when the box is on the peak of
+			the map, lower when it was moved off it (refinement,
+			fallbacks) and 0 when the map is empty there.
+		sharpness - 1 - second/peak, 0 when another part of the
+			map is as high as the peak (exudates, reflections...).
+		fit - 1/(1 + (residual/residual_scale)^2), only the very
+			scattered fits are penalised (1 without a fit).
+	On the labelled images of evaluation/output and on synthetic
+	images with bright lesions (see benchmarks) the right boxes
+	score higher than the wrong ones for every map, the smooth
+	maps (correlation, vessels) just score lower.
+
+	Args:
+		peaks - (local, peak, second) scores, see map_peaks and
+			candidate_peaks.
+		residual - float, fit_residual of the parabola, None
+			when there was no fit.
+		residual_scale - float, residual with a fit term of 0.5.
+
+	Returns:
+		The confidence (float).
+	"""
+	local, peak, second = peaks
+	if peak <= 0:
+		return 0.0
+	support = min(local/peak, 1.0)
+	sharpness = max(0.0, 1 - second/peak)
+	fit = 1.0 if residual is None else 1/(1 + (residual/residual_scale)**2)
+	return float(support*sharpness*fit)
+
+# Result of ODDetector.detect. The box is (x1, y1, x2, y2) in the
+# original image, params are the parabola (a, b, c) (NaNs when it
+# could not be fitted), score is the peak of the correlation map (or
+# of the vessel map, see ODDetector points) inside the mask, or the
+# candidate score with the "replace" localiser, fallback tells if
+# the parabola fit or the k-means/Gaussian refinement failed (the
+# bright_candidates were used instead), missed is the pyramid
+# audit result (None when the image was not audited), confidence
+# is the detection_confidence and tier the ODCascade tier that
+# gave the detection (None without a cascade).
+Detection = namedtuple("Detection", ["box", "params", "score", "fallback", "missed", "confidence", "tier"])
+
+
+class ODDetector(object):
+	"""
+	Optic disc detector. Everything that does not depend on
+	the image (circular mask, k-means criteria, kernels...) is
+	calculated once here, so the same detector can be used
+	for many images (notebooks, workers, etc).
+
+	Usage:
+		with ODDetector.from_file("pca.txt", threads=4) as detector:
+			box = detector.detect(grey_image).box
+	"""
+
+	def __init__(self, PCA, N=450, window=(30, 30), stride=5, radius=180, K=4,
+				 od_size=100, max_weight=5, cast=True, pyramid=False, levels=1, top_k=5,
+				 robust=False, kmeans="histogram", threads=1, timing=False,
+				 points="pca", vessel_size=21, vessel_fraction=0.1, localiser=None,
+				 box_sizes=(30, 45, 60)):
+		"""
+		Args:
+			PCA - numpy array (height*width, K) with the components.
+			N - int, square size the images are resized to.
+			window - (height, width) tuple of the sliding window.
+			stride - int, step between the windows.
+			radius - int, radius of the circular mask in pixels.
+			K - int, number of clusters for the k-means.
+			od_size - int, min size of the OD box (resized pixels).
+			max_weight - int, max weight of the points for the fit.
+			cast - bool, cast the PCA reconstructions to uint8.
+			pyramid - bool, use the coarse to fine search.
+			levels, top_k - pyramid settings (see pyramid_map).
+			robust - bool, use the robust parabola fit.
+			kmeans - "histogram" for kmeans_histogram (warm started
+				from the previous image), "opencv" for cv2.kmeans.
+			threads - int, number of threads used for the
+				correlation of each image (row bands of the uint8
+				cast or closed form scores, and the refined areas
+				of the pyramid search). See close.
+			timing - bool, time the stages of the detection (see
+				the timer attribute and timing.py).
+			points - source of the points of the parabola fit,
+				"pca" for the correlation array, "vessels" for the
+				vessel map (see vessel_map), taken from the green
+				channel when the images are BGR.
+			vessel_size - int, size of the top-hat kernel (resized
+				pixels), wider than the main vessels.
+			vessel_fraction - float, fraction of the pixels kept
+				by the vessel map.
+			localiser - use of the bright_candidates, "seed" to refine
+				the pyramid search around them (instead of the coarse
+				peaks), "replace" to use the best one as the vertex
+				(no correlation or fit at all), None to only use them
+				when the fit or the refinement fail.
+			box_sizes - tuple of ints, box sides of the candidates.
+		"""
+		self.PCA = PCA
+		self.N = N
+		self.window = tuple(window)
+		self.stride = stride
+		self.K = K
+		self.od_size = od_size
+		self.max_weight = max_weight
+		self.cast = cast
+		self.pyramid = pyramid
+		self.levels = levels
+		self.top_k = top_k
+		self.robust = robust
+		self.kmeans = kmeans
+		self.centres = None # Last k-means centres (warm start)
+
+		# Vessel map settings (the alternative point source)
+		if points not in ("pca", "vessels"):
+			raise ValueError("Unknown point source: {}".format(points))
+		self.points = points
+		self.vessel_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (vessel_size, vessel_size))
+		self.vessel_fraction = vessel_fraction
+
+		# Brightness pre-localiser (see bright_candidates)
+		if localiser not in (None, "seed", "replace"):
+			raise ValueError("Unknown localiser: {}".format(localiser))
+		self.localiser = localiser
+		self.box_sizes = tuple(box_sizes)
+
+		# Threads for the row bands of the correlation (kept for
+		# all the images, creating them for each one is slow)
+		self.threads = threads
+		self.pool = ThreadPoolExecutor(threads) if threads > 1 else None
+
+		# Stage timers (they do nothing unless enabled)
+		self.timer = tm.Timer(timing)
+
+		# Create the circular mask (from the center) to remove
+		# the iamge circular boarders.
+		Xs = np.ones((N,N))*np.arange(N)
+		Ys = Xs.T
+		s = np.floor(N/2) # Displacement
+		Xs, Ys = Xs - s, Ys - s
+		Dist = Xs*Xs + Ys*Ys
+		self.mask = Dist < radius**2
+
+		# Define criteria, stop when threshold is reached or the max iter is reached
+		self.criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 1.0)
+		self.erode_kernel = np.ones((7,7),np.uint8)
+
+		# The histogram iterations are cheap, so run it to convergence
+		# (cv2.kmeans makes up for its loose criteria with 10 attempts)
+		self.hist_criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 100, 0.01)
+
+	@classmethod
+	def from_file(cls, pca_path, **settings):
+		"""
+		Creates a detector from a PCA text file (see generate_pca.py).
+		"""
+		return cls(np.loadtxt(pca_path), **settings)
+
+	def close(self):
+		"""
+		Shuts down the threads of the row bands (if any), the
+		detector runs on a single thread after this. Also
+		called at the end of a with block.
+		"""
+		if self.pool is not None:
+			self.pool.shutdown()
+			self.pool = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+		return False
+
+	def correlation(self, masked_img, seeds=None):
+		"""
+		Returns the (corr_array, peaks) of the masked and resized
+		image, peaks is None unless the pyramid search is used
+		(always used with seeds, see pyramid_map).
+		"""
+		if self.pyramid or seeds is not None:
+			return pyramid_map(masked_img, self.PCA, self.window, self.stride,
+							   self.levels, self.top_k, mask=self.mask, cast=self.cast,
+							   seeds=seeds, pool=self.pool)
+		return batch_correlation_maps([masked_img], self.PCA, self.window, self.stride,
+									  self.cast, pool=self.pool)[0], None
+
+	def vessels(self, masked_img):
+		"""
+		Returns the vessel map of the masked and resized image
+		(see vessel_map), used instead of the correlation array.
+		"""
+		with self.timer.stage("vessels"):
+			return vessel_map(masked_img, self.mask, self.vessel_kernel, self.vessel_fraction)
+
+	def candidates(self, img_resized):
+		"""
+		Returns the bright_candidates of the resized grey image.
+		"""
+		with self.timer.stage("candidates"):
+			return bright_candidates(img_resized*self.mask, self.mask, self.box_sizes, self.top_k)
+
+	def seeds(self, img_resized):
+		"""
+		Returns the (y, x) seeds of the pyramid search ("seed"
+		localiser), None otherwise.
+		"""
+		if self.localiser != "seed":
+			return None
+		return [(y, x) for (x, y, _, _) in self.candidates(img_resized)]
+
+	def detect(self, image, audit=False, original_size=None):
+		"""
+		This function will detect the OD in the image.
+
+		Args:
+			image - numpy array representing the grey (or BGR) image,
+				or a string with the path of the image.
+			audit - bool, check the pyramid peaks against a full scan.
+			original_size - (height, width) of the full resolution
+				image when image is a reduced decode of it (see
+				utilities.read_reduced), the box is given in it.
+
+		Returns:
+			Detection namedtuple (see above).
+		"""
+		img_resized, masked_img, original_size = self._prepare(image, original_size)
+		return self._detect(img_resized, masked_img, original_size, audit)
+
+	def _detect(self, img_resized, masked_img, original_size, audit=False):
+		"""
+		Returns the Detection of the prepared image (see detect
+		and _prepare).
+		"""
+		if self.localiser == "replace":
+			corr_array, peaks = None, None # No fit, see _locate
+		elif self.points == "vessels":
+			corr_array, peaks = self.vessels(masked_img), None
+		else:
+			# Sliding algorithm (the PCA projection of every window)
+			seeds = self.seeds(img_resized)
+			with self.timer.stage("correlation"):
+				corr_array, peaks = self.correlation(masked_img, seeds)
+		return self._locate(img_resized, masked_img, corr_array, peaks, audit, original_size)
+
+	def detect_batch(self, images, audits=None, original_sizes=None):
+		"""
+		This function will detect the OD in several images at
+		once. Same as calling detect on each image, but the
+		correlation arrays are calculated together (see
+		batch_correlation_maps). The pyramid search is local
+		already, so it is still done one image at a time.
+
+		Args:
+			images - list of grey or BGR images (arrays or paths).
+			audits - list of bools (see detect), None for no audits.
+			original_sizes - list of sizes (see detect) or None.
+
+		Returns:
+			List of Detection namedtuples (same order as images).
+		"""
+		audits = audits or [False]*len(images)
+		original_sizes = original_sizes or [None]*len(images)
+		prepared = [self._prepare(image, size) for image, size in zip(images, original_sizes)]
+
+		masked = [masked_img for (_, masked_img, _) in prepared]
+		if self.localiser == "replace":
+			results = [(None, None)]*len(prepared)
+		elif self.points == "vessels":
+			results = [(self.vessels(masked_img), None) for masked_img in masked]
+		elif self.localiser == "seed":
+			seeds = [self.seeds(img_resized) for (img_resized, _, _) in prepared]
+			with self.timer.stage("correlation"):
+				results = [self.correlation(masked_img, seed) for masked_img, seed in zip(masked, seeds)]
+		else:
+			results = self._batch_correlation(masked)
+
+		return [self._locate(img_resized, masked_img, corr_array, peaks, audit, original_size)
+				for (img_resized, masked_img, original_size), (corr_array, peaks), audit
+				in zip(prepared, results, audits)]
+
+	def _batch_correlation(self, masked):
+		"""
+		Returns the list of (corr_array, peaks) of the masked
+		images (see detect_batch).
+		"""
+		with self.timer.stage("correlation"):
+			if self.pyramid:
+				results = [self.correlation(masked_img) for masked_img in masked]
+			else:
+				maps = batch_correlation_maps(masked, self.PCA, self.window, self.stride,
+											  self.cast, pool=self.pool)
+				results = [(corr_array, None) for corr_array in maps]
+		return results
+
+	def _prepare(self, image, original_size=None):
+		"""
+		Returns the (resized, masked, original_size) images
+		used by the detection (see detect for the args). The
+		masked one is the source of the fit points, so it is
+		the green channel for the vessel map of BGR images.
+		"""
+		if isinstance(image, str):
+			with self.timer.stage("decode"):
+				image = cv2.imread(image) if self.points == "vessels" else ut.read_image(image, "BGR2GRAY")
+		if original_size is None:
+			original_size = image.shape[0:2] # Stores the original size for later
+
+		# Resize the image (with dims (N,N))
+		S = self.N
+		with self.timer.stage("resize"):
+			green = None
+			if image.ndim == 3:
+				# Green channel for the vessels (most contrast), grey for the rest
+				green = image[:, :, 1] if self.points == "vessels" else None
+				image = ut.convert_spaces(image, "BGR2GRAY")
+			img_resized = cv2.resize(image, (S,S), cv2.INTER_AREA)
+			if green is None:
+				masked_img = img_resized*self.mask
+			else:
+				masked_img = cv2.resize(green, (S,S), cv2.INTER_AREA)*self.mask
+		return img_resized, masked_img, original_size
+
+	def _locate(self, img_resized, masked_img, corr_array, peaks, audit, original_size):
+		"""
+		This function will find the OD from the correlation
+		array of the image (parabola fit, region and refinement).
+		See detect for the args and the returned Detection.
+		"""
+		height, width = self.window
+		mask, S = self.mask, self.N
+
+		# Check if the full scan maximum was refined
+		missed = None
+		if audit and peaks is not None:
+			with self.timer.stage("audit"):
+				full = correlation_map(masked_img, self.PCA, self.window, self.stride, self.cast,
+									   pool=self.pool)*mask
+				y, x = np.unravel_index(np.argmax(full), full.shape)
+				near = [abs(y-p_y) <= max(width, height) and abs(x-p_x) <= max(width, height) for (p_y, p_x) in peaks]
+				missed = not any(near)
+
+		vertex, residual = None, None
+		if corr_array is not None:
+			# Kept for the confidence (the fit normalises the array)
+			score_map = np.maximum(corr_array, 0)*mask
+			score, params, vertex, residual = self._fit(corr_array)
+
+		# Brightest candidate when there is no vertex (failed
+		# fit, or the "replace" localiser)
+		candidates = None
+		fallback = corr_array is not None and vertex is None
+		if vertex is None:
+			candidates = self.candidates(img_resized)
+			vertex = candidates[0][0:2] if candidates else (S/2, S/2)
+			if corr_array is None:
+				score, params = (candidates[0][3] if candidates else 0.0), (np.nan,)*3
+		ext_x, ext_y = vertex
+
+		box, failed = self.box(img_resized, ext_x, ext_y, original_size, candidates)
+
+		# How much the box can be trusted, from the map used for
+		# the vertex (see detection_confidence)
+		centre, near = self.resized_centre(box, original_size), max(self.box_sizes)//2
+		if corr_array is None:
+			peaks = candidate_peaks(candidates, centre, near)
+		else:
+			peaks = map_peaks(score_map, centre, near, max(self.box_sizes))
+		confidence = detection_confidence(peaks, residual)
+		return Detection(box, tuple(float(p) for p in params), score, fallback or failed, missed,
+						 confidence, None)
+
+	def box(self, img_resized, ext_x, ext_y, original_size, candidates=None):
+		"""
+		This function will find the OD box in the region around
+		the (ext_x, ext_y) vertex of the resized image and bring
+		it back to the original image.
+
+		Args:
+			img_resized - numpy array with the resized grey image.
+			ext_x, ext_y - vertex (or candidate) in the resized image.
+			original_size - (height, width) of the original image.
+			candidates - bright_candidates of the image if already
+				known, they are only needed when the refinement fails.
+
+		Returns:
+			((x1, y1, x2, y2), fallback) tuple, fallback tells if the
+			refinement failed.
+		"""
+		S, od_size = self.N, self.od_size
+
+		# Multiply by the scalling factor, original_size is
+		# (height, width) and factors are (x, y)
+		factors = (original_size[1]/S, original_size[0]/S)
+
+		################################
+		## Getting the ROI for the OD ##
+		################################
+		# Get the region obtained (centered at the OD location we found
+		# previosuly). The size of this region can be cahnged, but so far 
+		# this size contains about 1/4 of the image area.
+		region_x1, region_y1, region_x2, region_y2 = self.region(ext_x, ext_y)
+		region = img_resized[region_y1:region_y2,region_x1:region_x2]
+
+		fallback = False
+		try:
+			x1, y1, x2, y2 = self.refine(region)
+		except (ValueError, cv2.error):
+			# No box out of the k-means/Gaussian, so take the box of
+			# the brightest candidate in the region (or the vertex)
+			fallback = True
+			if candidates is None:
+				candidates = self.candidates(img_resized)
+			inside = [(x, y) for (x, y, _, _) in candidates
+					  if region_x1 <= x < region_x2 and region_y1 <= y < region_y2]
+			c_x, c_y = inside[0] if inside else (ext_x, ext_y)
+			x1, y1 = int(max(c_x - od_size/2, 0)) - region_x1, int(max(c_y - od_size/2, 0)) - region_y1
+			x2, y2 = int(min(c_x + od_size/2, S)) - region_x1, int(min(c_y + od_size/2, S)) - region_y1
+
+		# Get the original positions now
+		x1 = int((region_x1 + x1)*factors[0]); y1 = int((region_y1 + y1)*factors[1])
+		x2 = int((region_x1 + x2)*factors[0]); y2 = int((region_y1 + y2)*factors[1])
+
+		return (x1, y1, x2, y2), fallback
+
+	def resized_centre(self, box, original_size):
+		"""
+		Returns the (x, y) centre of a box of the original image
+		in the resized image (the inverse of the box scaling).
+		"""
+		S = self.N
+		factors = (original_size[1]/S, original_size[0]/S) # (x, y), same as box
+		x1, y1, x2, y2 = box
+		return ((x1 + x2)/2/factors[0], (y1 + y2)/2/factors[1])
+
+	def _fit(self, corr_array):
+		"""
+		This function will fit the parabola to the correlation
+		(or vessel) array and return the (score, params, vertex,
+		residual) tuple. The vertex (resized) is None when the fit
+		failed (not enough points) or the vertex is off the image,
+		the residual (see fit_residual) is None without a fit.
+		"""
+		mask, S, max_weight = self.mask, self.N, self.max_weight
+		with self.timer.stage("fit"):
+			# Peak score (before the normalisation below)
+			score = float(np.max(corr_array*mask))
+
+			# Normalise the array
+			corr_array[corr_array < 0] = 0 # Threshold by 0
+			cv2.normalize(corr_array, corr_array, 0, 255, cv2.NORM_MINMAX)
+
+			# Apply mask
+			corr_array *= mask
+
+			##########################
+			###### Line Fitting ######
+			##########################
+			cv2.normalize(corr_array, corr_array, 0, max_weight, cv2.NORM_MINMAX)
+			corr_array = np.round(corr_array)
+
+			# Fit the line parameters (straight from the weight map)
+			try:
+				params = fit_parabola(corr_array, max_weight, self.robust)
+			except ValueError:
+				return score, (np.nan, np.nan, np.nan), None, None
+			residual = fit_residual(corr_array, max_weight, params)
+
+			# Get the extrema (in resized)
+			ext_x, ext_y = parabola_vertex(params)
+			if not (0 <= ext_x < S and 0 <= ext_y < S):
+				return score, params, None, residual
+			return score, params, (ext_x, ext_y), residual
+
+	def region(self, ext_x, ext_y):
+		"""
+		Returns the (x1, y1, x2, y2) corners of the region (in
+		the resized image) centred at the parabola vertex.
+		"""
+		S = self.N
+		size = S/2.5
+		region_x1, region_y1 = int(max(ext_x - size/2, 0)), int(max(ext_y - size/2,0))
+		region_x2, region_y2 = int(min(ext_x + size/2, S)), int(min(ext_y + size/2, S))
+		return (region_x1, region_y1, region_x2, region_y2)
+
+	def cluster(self, region):
+		"""
+		This function will cluster the intensities of the region
+		with the k-means and return the region with each pixel
+		set to its (uint8) cluster centre.
+		"""
+		if self.kmeans == "opencv":
+			# Convert to np.float32 for the K-Means
+			Z = np.float32(region.reshape((-1)))
+
+			# Perform K-Means with OpenCV's function
+			ret,label,center=cv2.kmeans(Z,self.K,None,self.criteria,10,cv2.KMEANS_RANDOM_CENTERS)
+
+			# Now convert back into uint8, and make original image
+			center = np.uint8(center)
+			res = center[label.flatten()]
+			return res.reshape((region.shape))
+
+		# Same clustering on the histogram, warm started
+		centres, lut = kmeans_histogram(region, self.K, self.hist_criteria, self.centres)
+		self.centres = centres
+		return np.uint8(centres)[lut][region]
+
+	def refine(self, region):
+		"""
+		This function will find the OD box inside the region
+		around the parabola vertex (k-means, erosion and a
+		Gaussian fit on the brightest pixels).
+
+		Args:
+			region - numpy array with the grey region (resized image).
+
+		Returns:
+			(x1, y1, x2, y2) tuple with the box in the region.
+		"""
+		od_size, S = self.od_size, self.N
+		with self.timer.stage("kmeans"):
+			k_means_region = self.cluster(region)
+
+		with self.timer.stage("gaussian"):
+			# Apply the erosion 
+			erosion = cv2.erode(k_means_region,self.erode_kernel,iterations = 1)
+
+			###########################
+			## Single Gaussian Stuff ##
+			###########################
+
+			# Get the maximum value of the erosion 
+			m_colour = np.max(erosion)
+
+			# Get the location of these points (Equivalent to I)
+			Ys, Xs = np.where(erosion==m_colour)
+
+			# First col is Ys, second col is Xs
+			samples = np.vstack((Ys,Xs)).T
+
+			# Score the points under a diagonal Gaussian
+			scores = gaussian_scores(samples)
+			# Mean and std_dev for threshold calc
+			mean = np.mean(scores)
+			std = np.sqrt(np.var(scores))
+
+			# Keep the points within the threshold, the box is
+			# taken directly from them (raises if none are left,
+			# so detect falls back to the vertex box)
+			filtered = scores > mean - 2*std
+			Ys, Xs = Ys[filtered], Xs[filtered]
+			x1, y1 = int(np.min(Xs)), int(np.min(Ys))
+			x2, y2 = int(np.max(Xs)), int(np.max(Ys))
+
+		if x2-x1 < od_size:
+			compensate = od_size - (x2-x1)
+			x1 = int(max(0, x1-compensate/2))
+			x2 = int(min(S, x2+compensate/2))
+		if y2-y1 < od_size:
+			compensate = od_size - (y2-y1)
+			y1 = int(max(0, y1-compensate/2))
+			y2 = int(min(S, y2+compensate/2))
+
+		return (x1, y1, x2, y2)
+
+	def detect_many(self, images):
+		"""
+		Generator version of detect for an iterable of images
+		(arrays or paths), the detector state is shared.
+		"""
+		for image in images:
+			yield self.detect(image)
+
+
+
+class ODCascade(object):
+	"""
+	Cascade of optic disc detectors, cheapest first. Each image
+	goes down the tiers until one of them is confident enough
+	(see detection_confidence), so the full PCA search and
+	refinement only run on the hard images. The last tier is
+	always accepted. The tier times are kept apart from the
+	stage times, so the time saved can be reported.
+
+	Usage:
+		cascade = ODCascade.from_settings(np.loadtxt("pca.txt"))
+		detection = cascade.detect(grey_image)
+		detection.tier, cascade.tier_timer.pop()
+	"""
+
+	def __init__(self, tiers, threshold=0.15):
+		"""
+		Args:
+			tiers - list of (name, ODDetector) tuples, cheapest
+				first, they must have the same N.
+			threshold - float, min confidence to accept the
+				detection of a tier (other than the last one).
+		"""
+		self.tiers = tiers
+		self.threshold = threshold
+		self.N = tiers[-1][1].N
+
+		# The tiers share the stage timer of the last one, the
+		# tier timer is always enabled
+		self.timer = tiers[-1][1].timer
+		for (_, detector) in tiers:
+			detector.timer = self.timer
+		self.tier_timer = tm.Timer(True)
+
+		# The images need the colour if any tier uses the vessels
+		self.points = "vessels" if any(d.points == "vessels" for (_, d) in tiers) else "pca"
+
+	@classmethod
+	def from_settings(cls, PCA, threshold=0.15, **settings):
+		"""
+		Creates the default cascade: the brightest candidate
+		("replace" localiser), the vessel map fit and then the
+		detector with the given settings (see ODDetector).
+		"""
+		cheap = dict(settings, threads=1, localiser=None)
+		tiers = [("bright", ODDetector(PCA, **dict(cheap, localiser="replace")))]
+		if settings.get("points", "pca") != "vessels":
+			tiers.append(("vessels", ODDetector(PCA, **dict(cheap, points="vessels"))))
+		tiers.append(("full", ODDetector(PCA, **settings)))
+		return cls(tiers, threshold)
+
+	def close(self):
+		"""
+		Closes the detectors of the tiers (see ODDetector.close).
+		"""
+		for (_, detector) in self.tiers:
+			detector.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+		return False
+
+	def detect(self, image, audit=False, original_size=None):
+		"""
+		This function will detect the OD in the image with the
+		cheapest confident tier (see ODDetector.detect for the
+		args, the audit only runs on the last tier).
+
+		Returns:
+			Detection namedtuple, with the name of the tier.
+		"""
+		if isinstance(image, str):
+			with self.timer.stage("decode"):
+				image = cv2.imread(image) if self.points == "vessels" else ut.read_image(image, "BGR2GRAY")
+
+		for k, (name, detector) in enumerate(self.tiers):
+			last = k == len(self.tiers) - 1
+			with self.tier_timer.stage(name):
+				detection = detector.detect(image, audit and last, original_size)
+			if last or detection.confidence >= self.threshold:
+				return detection._replace(tier=name)
+
+	def detect_batch(self, images, audits=None, original_sizes=None):
+		"""
+		Same as ODDetector.detect_batch, the images go through
+		the cascade one at a time.
+		"""
+		audits = audits or [False]*len(images)
+		original_sizes = original_sizes or [None]*len(images)
+		return [self.detect(image, audit, size) for image, audit, size in zip(images, audits, original_sizes)]
+
+class ODTracker(object):
+	"""
+	Optic disc tracker for the frames of a sequence (video or
+	burst). The full detection only runs on the keyframes,
+	every keyframes frames or when the track is lost. On the
+	other frames the disc is only looked for in a small window
+	around the previous one (bright_candidates) and the box is
+	refined there, which is much cheaper than the full search.
+	The track is lost when the disc score drops below
+	min_score times the best score since the last keyframe.
+
+	Usage:
+		tracker = ODTracker(ODDetector.from_file("pca.txt"))
+		for frame in frames:
+			detection, keyframe = tracker.update(frame)
+	"""
+
+	def __init__(self, detector, keyframes=30, search=40, min_score=0.5):
+		"""
+		Args:
+			detector - ODDetector used for the frames.
+			keyframes - int, max number of frames between two
+				full detections.
+			search - int, search radius around the previous disc
+				centre (pixels of the resized frame).
+			min_score - float, fraction of the reference score
+				(best since the keyframe) under which the track is lost.
+		"""
+		self.detector = detector
+		self.keyframes = keyframes
+		self.search = search
+		self.min_score = min_score
+		self.lost = 0 # Number of times the track was lost
+		self.reset()
+
+	def reset(self):
+		"""
+		Forgets the track, so the next frame is a keyframe.
+		"""
+		self.centre = None # Disc centre (resized frame)
+		self.reference = None # Best disc score since the keyframe
+		self.since = 0 # Frames since the last keyframe
+
+	def local_candidate(self, img_resized, centre):
+		"""
+		Returns the best bright_candidates (x, y, size, score)
+		within the search radius of centre (resized frame), or
+		None if there are no candidates.
+		"""
+		detector = self.detector
+		S, x, y = detector.N, centre[0], centre[1]
+
+		# The window holds the boxes centred within the radius
+		reach = self.search + max(detector.box_sizes)//2
+		x1, y1 = int(max(x - reach, 0)), int(max(y - reach, 0))
+		x2, y2 = int(min(x + reach, S)), int(min(y + reach, S))
+		if min(x2 - x1, y2 - y1) < max(detector.box_sizes):
+			return None # Off the frame
+		mask = detector.mask[y1:y2, x1:x2]
+		with detector.timer.stage("candidates"):
+			found = bright_candidates(img_resized[y1:y2, x1:x2]*mask, mask, detector.box_sizes, 1)
+		if not found:
+			return None
+		c_x, c_y, size, score = found[0]
+		return (c_x + x1, c_y + y1, size, score)
+
+	def update(self, frame):
+		"""
+		This function will find the OD in the next frame.
+
+		Args:
+			frame - numpy array with the grey (or BGR) frame.
+
+		Returns:
+			(detection, keyframe) tuple, where detection is the
+			Detection of the frame (on the tracked frames params
+			are NaNs, score is the disc score, see bright_candidates,
+			and confidence is the score over the best one of the
+			track) and keyframe tells if the full detection was used.
+		"""
+		detector = self.detector
+		img_resized, masked_img, original_size = detector._prepare(frame)
+
+		if self.centre is not None and self.since < self.keyframes:
+			found = self.local_candidate(img_resized, self.centre)
+			if found is not None and found[3] >= self.min_score*self.reference:
+				# Confidence relative to the best disc of the track
+				confidence = min(1.0, found[3]/self.reference)
+				self.since += 1
+				self.centre = found[0:2]
+				self.reference = max(self.reference, found[3])
+				box, fallback = detector.box(img_resized, found[0], found[1], original_size)
+				return Detection(box, (np.nan, np.nan, np.nan), found[3], fallback, None,
+								 confidence, None), False
+			self.lost += 1
+
+		# Keyframe, full detection and a new reference score
+		self.reset()
+		detection = detector._detect(img_resized, masked_img, original_size)
+		found = self.local_candidate(img_resized, detector.resized_centre(detection.box, original_size))
+		if found is not None and found[3] > 0:
+			self.centre, self.reference = found[0:2], found[3]
+		return detection, True
@@ -1,6 +1,12 @@
 import cv2
 import numpy as np
-from scipy.stats import multivariate_normal
+from collections import namedtuple
+from functools import lru_cache
+
+
+# Max number of kernels kept by each kernel factory (the
+# kernels are read only, so the cached arrays are shared)
+KERNEL_CACHE_SIZE = 32
 
 
 def assert_odd(v):
@@ -9,80 +15,252 @@ def assert_odd(v):
         return v%2==1
     return False
 
+def _read_only(X):
+    """
+    Returns the array after making it read only, so the
+    cached kernels can not be changed by the callers.
+    """
+    X.flags.writeable = False
+    return X
+
 def gaussian_kernel(N, mu, sigma):
     """
     This function will generate the gaussian blur
     kernel given the matrix size N and the 
-    variance sigma.
+    variance sigma. The kernel is cached (read only).
     """
+    # Lists are not hashable, so the mean goes as a tuple
+    return _gaussian_kernel(N, tuple(float(m) for m in mu), float(sigma))
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _gaussian_kernel(N, mu, sigma):
+    # Same normal as before (ID covariance), which is the
+    # product of the row and column normals
+    kernel_x, kernel_y = _gaussian_separable(N, mu, sigma)
+    return _read_only(np.outer(kernel_y, kernel_x))
+
+def gaussian_separable(N, mu, sigma):
+    """
+    Returns the (kernel_x, kernel_y) 1D kernels of the
+    gaussian_kernel, so that np.outer(kernel_y, kernel_x)
+    is the 2D kernel (e.g. for cv2.sepFilter2D). Both are
+    cached (read only).
+    """
+    return _gaussian_separable(N, tuple(float(m) for m in mu), float(sigma))
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def _gaussian_separable(N, mu, sigma):
     # Asserting N is odd and sigma is number
     assert assert_odd(N)
-    
-    # Create the normal here (with ID covariance) 
-    normal = multivariate_normal(mean=mu, cov=sigma*np.identity(2))
-    
-    # Create the position matries (x_1,x_2 in 2D)
-    X_1 = np.ones((N,N))*np.arange(N) # x_1 pos
-    X_2 = X_1.T #x_2 pos, just transpose the above
-    
-    # Shift the positions so center is at middle
-    s = np.floor(N/2) #shift value
-    X_1, X_2 = X_1-s, X_2-s # shifted matrices
-    
-    # Create holder matrix
-    X = np.zeros((N,N)) # Below we have the iterator 
-    for (i,j) in [(i,j) for i in range(N) for j in range(N)]:
-        X[i,j] = normal.pdf([X_1[i,j], X_2[i,j]]) # Normal values
-        
-    # Finally just return the normalized kernel
-    return X*(1/np.sum(X))
 
+    # Positions shifted so the center is at the middle, x_1
+    # (mu[0]) are the columns and x_2 (mu[1]) the rows
+    X = np.arange(N) - np.floor(N/2)
+    kernel_x = np.exp(-(X - mu[0])**2/(2*sigma))
+    kernel_y = np.exp(-(X - mu[1])**2/(2*sigma))
+
+    # Normalised, so the 2D kernel adds up to 1
+    return _read_only(kernel_x/np.sum(kernel_x)), _read_only(kernel_y/np.sum(kernel_y))
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
 def delta(N):
     """
     Generates the delta function given 
     an odd square dimension N by 
-    creating zero matrix.
+    creating zero matrix (cached, read only).
     """
     assert assert_odd(N) # Make sure kernel is odd
     X = np.zeros((N,N)) # Square matrix with all 0s
     middle = int(N/2) # Get the middle cell
     X[middle, middle] = 1
-    return X
+    return _read_only(X)
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def unsharp_kernel(N, sigma, a=5, b=4):
+    """
+    Generates the unsharp mask a*delta - b*gaussian (the
+    gaussian_kernel centred at 0) of size N, cached and
+    read only. It has no separable form (rank 2).
+    """
+    return _read_only(a*delta(N) - b*gaussian_kernel(N, [0,0], sigma))
+
+@lru_cache(maxsize=KERNEL_CACHE_SIZE)
+def laplacian_kernel():
+    """
+    Returns the 3x3 approximation of the laplacian
+    (cached, read only), it has no separable form.
+    """
+    return _read_only(np.array([[0.,1.,0.], [1.,-4.,1.], [0.,1.,0.]]))
+
+# Kernels with at least this many cells are convolved with
+# the FFT by default (see convolution), the shifted sums are
+# faster for the smaller ones
+FFT_MIN_CELLS = 7*7
 
-def convolution(matrix, kernel):
+def convolution(matrix, kernel, method="auto"):
     """
     This function will perform convolution
     with the given matrix and kernel. This
     function uses 0 padding on the outside
-    borders.
+    borders. Like always, the kernel is not
+    flipped (each output is the sum of the
+    kernel times the window around it) and
+    its sides must be odd. The matrix can also
+    be a (N, H, W) stack of images, each one
+    convolved with the kernel.
+
+    The method is "direct" (one weighted sum of
+    the shifted padded matrix per kernel cell,
+    the zero cells are skipped), "fft" (zero
+    padded FFT, exact up to rounding) or "auto"
+    to pick the FFT for kernels with at least
+    FFT_MIN_CELLS cells. Returns a float64 array
+    the shape of matrix.
     """
-    assert assert_odd(kernel.shape[0])
+    assert assert_odd(kernel.shape[0]) and assert_odd(kernel.shape[1])
+    if method == "auto":
+        method = "fft" if kernel.size >= FFT_MIN_CELLS else "direct"
     
-    # Padded matrix (0s on the outsides)
-    N = kernel.shape[0] # Get the dim for the kernel
-    I = np.pad(matrix, int(N/2), "constant")
+    h, w = matrix.shape[-2:] # Get width and height
+    s_y, s_x = int(kernel.shape[0]/2), int(kernel.shape[1]/2) # Spacing of the matrix
     
-    # Now do the convolution
+    if method == "fft":
+        # Full convolution with the flipped kernel (the sizes
+        # leave room for it, so nothing wraps around), the
+        # window of each pixel starts at its padded position
+        shape = (cv2.getOptimalDFTSize(h + 2*s_y), cv2.getOptimalDFTSize(w + 2*s_x))
+        flipped = np.asarray(kernel, dtype=np.float64)[::-1, ::-1]
+        full = np.fft.irfft2(np.fft.rfft2(matrix, shape)*np.fft.rfft2(flipped, shape), shape)
+        return full[..., s_y:s_y+h, s_x:s_x+w]
+    if method != "direct":
+        raise ValueError("Unknown convolution method: {}".format(method))
+
+    # Padded matrix (0s on the outsides of each image)
+    pad = [(0, 0)]*(matrix.ndim - 2) + [(s_y, s_y), (s_x, s_x)]
+    I = np.pad(matrix.astype(np.float64), pad, "constant")
+
+    # Now do the convolution, one kernel cell at a time
     C = np.zeros(matrix.shape) # This is the convolved image
-    h, w = C.shape # Get width and height
-    s = int(N/2) # Spacing of the matrix
-    positions = [(i,j) for i in range(h) for j in range(w)]
-    for (i,j) in positions:
-        y, x = i+s,j+s # Shift the center to the right position
+    product = np.empty(matrix.shape)
+    for (a, b) in zip(*np.nonzero(kernel)):
+        np.multiply(kernel[a, b], I[..., a:a+h, b:b+w], out=product)
+        C += product
         
-        # Calc the convolution at each pixel
-        C[i,j] = np.sum(np.multiply(kernel, I[y-s:y+s+1,x-s:x+s+1]))
-        
-    # Return the clipped array as uint8
     return C
 
-def image_conv(image, kernel):
+# Max number of image_conv plans kept (the DFT ones hold the
+# kernel spectrum, which is the size of the image)
+PLAN_CACHE_SIZE = 8
+
+# Limits of the plan_conv methods (see the table of
+# benchmarks/conv_benchmark.py). The separable filter only
+# pays off from 5x5 and the DFT beats it over 31x31 (taps
+# are the rows plus the columns), the other kernels with at
+# least DFT_MIN_CELLS cells are applied with the DFT
+SEPARABLE_MIN_CELLS = 5*5
+SEPARABLE_MAX_TAPS = 31 + 31
+DFT_MIN_CELLS = 15*15
+
+# How image_conv applies a kernel. The method is "separable"
+# (cv2.sepFilter2D with the kernel_x and kernel_y of a rank 1
+# kernel), "direct" (cv2.filter2D with the kernel) or "dft"
+# (product with the spectrum of the kernel, padded to the
+# dft_size), the fields of the other methods are None
+Plan = namedtuple("Plan", ["method", "kernel", "kernel_x", "kernel_y", "spectrum", "dft_size"])
+
+def _dft_depth(dtype):
+    # Working depth of the DFT for images of the dtype
+    return np.float64 if dtype == np.float64 else np.float32
+
+def plan_conv(shape, dtype, kernel, method="auto"):
+    """
+    This function will return the Plan of image_conv for
+    the kernel and images of the shape and dtype. The auto
+    method is the cheapest one: separable for the rank 1
+    kernels (e.g. the gaussians) within the limits above,
+    the DFT for the other ones with at least DFT_MIN_CELLS
+    cells, direct for the rest. The plans are cached (read
+    only).
+    """
+    kernel = np.asarray(kernel, dtype=np.float64)
+    return _plan_conv(kernel.tobytes(), kernel.shape, tuple(shape[0:2]), np.dtype(dtype).str, method)
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _plan_conv(kernel_bytes, kernel_shape, shape, dtype, method):
+    kernel = _read_only(np.frombuffer(kernel_bytes, dtype=np.float64).reshape(kernel_shape).copy())
+
+    # Rank 1 kernels are the outer product of two 1D ones
+    U, S, Vt = np.linalg.svd(kernel)
+    rank_1 = len(S) < 2 or S[1] <= 1e-12*S[0]
+    if method == "auto":
+        if rank_1 and SEPARABLE_MIN_CELLS <= kernel.size and sum(kernel_shape) <= SEPARABLE_MAX_TAPS:
+            method = "separable"
+        else:
+            method = "dft" if kernel.size >= DFT_MIN_CELLS else "direct"
+
+    if method == "separable":
+        if not rank_1:
+            raise ValueError("The kernel is not separable (rank 1).")
+        sign = -1 if np.sum(U[:, 0]) < 0 else 1 # Keep the 1D kernels positive
+        kernel_y = _read_only(sign*np.sqrt(S[0])*U[:, 0])
+        kernel_x = _read_only(sign*np.sqrt(S[0])*Vt[0])
+        return Plan(method, kernel, kernel_x, kernel_y, None, None)
+    if method == "direct":
+        return Plan(method, kernel, None, None, None, None)
+    if method != "dft":
+        raise ValueError("Unknown convolution method: {}".format(method))
+
+    # Spectrum of the kernel, padded to the (fast) size of the
+    # DFT of the bordered image (see _dft_filter, the border is
+    # one row/column wider than the kernel for the even sizes)
+    height, width = shape[0] + 2*(kernel_shape[0]//2), shape[1] + 2*(kernel_shape[1]//2)
+    dft_size = (cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width))
+    padded = np.zeros(dft_size, dtype=_dft_depth(np.dtype(dtype)))
+    padded[:kernel_shape[0], :kernel_shape[1]] = kernel
+    return Plan(method, kernel, None, None, _read_only(cv2.dft(padded)), dft_size)
+
+def _dft_filter(image, plan):
+    """
+    Same as cv2.filter2D(image, -1, kernel) for one channel
+    (see image_conv), with the DFT of the plan.
+    """
+    s_y, s_x = int(plan.kernel.shape[0]/2), int(plan.kernel.shape[1]/2)
+    h, w = image.shape
+
+    # Same border as filter2D, then the correlation is the
+    # product with the conjugate of the kernel spectrum
+    bordered = cv2.copyMakeBorder(image, s_y, s_y, s_x, s_x, cv2.BORDER_REFLECT_101)
+    padded = np.zeros(plan.dft_size, dtype=_dft_depth(image.dtype))
+    padded[:bordered.shape[0], :bordered.shape[1]] = bordered
+    product = cv2.mulSpectrums(cv2.dft(padded), plan.spectrum, 0, conjB=True)
+    C = cv2.idft(product, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)[:h, :w]
+
+    # Back to the image depth (rounded and saturated like OpenCV)
+    if np.issubdtype(image.dtype, np.integer):
+        limits = np.iinfo(image.dtype)
+        C = np.clip(np.rint(C), limits.min, limits.max)
+    return C.astype(image.dtype)
+
+def image_conv(image, kernel, method="auto"):
     """
     This function will convolute the image
     with the kernel given. It differs from 
     the previous convolution as it uses
-    OpenCV's filter2D function.
+    OpenCV's filters, with the same results
+    as cv2.filter2D (kernel not flipped,
+    reflected borders, same depth) up to the
+    rounding. The way the kernel is applied
+    is planned once for each kernel and image
+    shape (see plan_conv), the method can
+    also be forced.
     """
+    plan = plan_conv(image.shape, image.dtype, kernel, method)
+    if plan.method == "separable":
+        return cv2.sepFilter2D(image, -1, plan.kernel_x, plan.kernel_y)
+    if plan.method == "dft":
+        if image.ndim == 3:
+            return cv2.merge([_dft_filter(channel, plan) for channel in cv2.split(image)])
+        return _dft_filter(image, plan)
     
     # Filter2D used for performance
-    return cv2.filter2D(image, -1, kernel)
+    return cv2.filter2D(image, -1, plan.kernel)
@@ -5,12 +5,16 @@ given the directory.
 
 
 Usage:
-    image_conversion.py ROOT OUTPUT FORMAT
+    image_conversion.py ROOT OUTPUT FORMAT [--fast]
 
 Arguments:
     ROOT                 The root directory of the image dataset.
     OUTPUT               The output directory to save processed images.
     FORMAT               The format for the files to be converted.
+
+Options:
+    --fast               Find the eye on a thumbnail of the image, much
+                         faster on large images (see analysis.field_rect).
 """
 
 import files, cv2 # For the file management stuff
@@ -51,7 +55,8 @@ if __name__== "__main__":
     # For now, just print out settings and  all the images in the root.
     print(Fore.BLUE + "Settings passed: ")
     print("Root directory........ %s" % root_path)
-    print("Output directory...... %s\n" % out_path)
+    print("Output directory...... %s" % out_path)
+    print("Fast bounding box..... %s\n" % arguments['--fast'])
 
     # Check that both directories exist
     if os.path.lexists(root_path):
@@ -75,7 +80,7 @@ if __name__== "__main__":
         image = ut.read_image(img_path, "BGR2RGB") #grayscale
 
         # Do the image cropping and save to the output
-        rect = an.get_rect(image) # Ruple with bounding rect coords
+        rect = an.get_rect(image, arguments['--fast']) # Ruple with bounding rect coords
         cropped = image[rect[1]:rect[3],rect[0]:rect[2]] # Simple cropping
 
         # Saving the processed file 
@@ -0,0 +1,104 @@
+""" Optic Disk Detection Client
+
+This script is a small client for od_daemon.py. It sends
+every image as a separate request, all at the same time
+(so the daemon batches them), and prints one JSON result
+per line. It only imports the standard library and docopt
+(no OpenCV or numpy), so it starts up quickly.
+
+Usage:
+    od_client.py IMAGE... [options]
+    od_client.py --health [options]
+
+Arguments:
+    IMAGE           Paths of the images to detect.
+
+Options:
+    --socket=<path>     Unix socket of the daemon (instead of the port).
+    --port=<n>          Localhost HTTP port of the daemon [default: 8750].
+    --bytes             Send the image bytes instead of the paths
+                        (for images the daemon cannot read).
+    --health            Print the daemon status.
+"""
+
+import os, sys, json, socket
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from docopt import docopt # CLI argument parser
+
+
+class UnixConnection(http.client.HTTPConnection):
+	"""
+	HTTPConnection over a Unix socket.
+	"""
+
+	def __init__(self, path, timeout=60):
+		http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+		self.socket_path = path
+
+	def connect(self):
+		self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.sock.settimeout(self.timeout)
+		self.sock.connect(self.socket_path)
+
+
+def request(method, path, body=None, headers=None, socket_path=None, port=8750):
+	"""
+	This function will send a request to the daemon.
+
+	Args:
+		method - string, "GET" or "POST".
+		path - string, path of the request (e.g. "/detect").
+		body - bytes of the request body, or None.
+		headers - dict with the request headers, or None.
+		socket_path - path of the Unix socket, or None to use
+			the localhost port.
+		port - int, localhost port of the daemon.
+
+	Returns:
+		The JSON response (dict).
+	"""
+	if socket_path:
+		connection = UnixConnection(socket_path)
+	else:
+		connection = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+	try:
+		connection.request(method, path, body, headers or {})
+		return json.loads(connection.getresponse().read().decode())
+	finally:
+		connection.close()
+
+
+def detect_image(img_path, send_bytes=False, socket_path=None, port=8750):
+	"""
+	Asks the daemon for the OD box of one image, returns
+	the result dict (box, params, score and fallback, or
+	the error). The params are None when the fit failed.
+	"""
+	if send_bytes:
+		with open(img_path, "rb") as f:
+			body, headers = f.read(), {"Content-Type": "application/octet-stream"}
+	else:
+		body = json.dumps({"paths": [os.path.abspath(img_path)]}).encode()
+		headers = {"Content-Type": "application/json"}
+	result = request("POST", "/detect", body, headers, socket_path, port)["results"][0]
+	result["path"] = img_path
+	return result
+
+
+# Main program here
+if __name__== "__main__":
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(__doc__, version="1.0")
+	socket_path, port = arguments['--socket'], int(arguments['--port'])
+
+	if arguments['--health']:
+		print(json.dumps(request("GET", "/health", socket_path=socket_path, port=port)))
+		sys.exit(0)
+
+	images = arguments['IMAGE']
+	with ThreadPoolExecutor(len(images)) as pool:
+		results = pool.map(lambda path : detect_image(path, arguments['--bytes'], socket_path, port), images)
+		for result in results:
+			print(json.dumps(result))
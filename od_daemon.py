@@ -0,0 +1,235 @@
+""" Optic Disk Detection Daemon
+
+This script keeps an OD detector loaded (PCA, imports and
+all) and serves detections over a local Unix socket or a
+localhost HTTP port, so each call does not pay for the
+start up. Concurrent requests are grouped into batches
+(see detection.ODDetector.detect_batch), up to the max
+batch size and waiting at most the max delay for a batch
+to fill up.
+
+Requests (HTTP, JSON responses):
+    POST /detect    JSON body {"paths": [...]} with image
+                    paths, or the encoded bytes of one image.
+    GET  /health    Status and batching stats.
+
+See od_client.py for a small client.
+
+Usage:
+    od_daemon.py PCA [options]
+
+Arguments:
+    PCA             The path to the PCA file.
+
+Options:
+    --socket=<path>     Use this Unix socket instead of the port.
+    --port=<n>          Localhost HTTP port [default: 8750].
+    --max-batch=<n>     Max number of images per batch [default: 8].
+    --max-delay=<ms>    Max time to wait for a batch to fill
+                        up [default: 10].
+    --no-cast           Use the closed form TM_CCOEFF map.
+    --pyramid           Use the coarse to fine search.
+    --kmeans=<m>        K-means of the OD region [default: histogram].
+    --threads=<n>       Threads per batch (row bands) [default: 1].
+"""
+
+import os, sys, cv2, json, time, queue, signal, threading, socketserver
+import utilities as ut
+import detection as det
+import numpy as np
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import Future
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+
+class Batcher(object):
+	"""
+	Runs the detections in a single thread, grouping the
+	images submitted (from any thread) into batches.
+	"""
+
+	def __init__(self, detector, max_batch=8, max_delay=0.01):
+		"""
+		Args:
+			detector - detection.ODDetector used for the images.
+			max_batch - int, max number of images per batch.
+			max_delay - float, max seconds to wait for a batch
+				to fill up after its first image.
+		"""
+		self.detector = detector
+		self.max_batch = max_batch
+		self.max_delay = max_delay
+		self.batches, self.images = 0, 0
+		self.queue = queue.Queue()
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.thread.start()
+
+	def submit(self, image):
+		"""
+		Queues a grey image, returns the Future of its Detection.
+		"""
+		future = Future()
+		self.queue.put((image, future))
+		return future
+
+	def _run(self):
+		while True:
+			# Wait for the first image, then fill up the batch
+			items = [self.queue.get()]
+			deadline = time.monotonic() + self.max_delay
+			while len(items) < self.max_batch:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					break
+				try:
+					items.append(self.queue.get(timeout=remaining))
+				except queue.Empty:
+					break
+
+			self.batches += 1
+			self.images += len(items)
+			try:
+				detections = self.detector.detect_batch([image for (image, _) in items])
+				for (_, future), detection in zip(items, detections):
+					future.set_result(detection)
+			except Exception:
+				# One at a time, so a bad image only fails its own request
+				for image, future in items:
+					try:
+						future.set_result(self.detector.detect(image))
+					except Exception as e:
+						future.set_exception(e)
+
+
+def _finite(value):
+	"""
+	Returns the value as a float, or None when it is not finite
+	(NaN is not valid JSON, e.g. the params of a failed fit).
+	"""
+	value = float(value)
+	return value if np.isfinite(value) else None
+
+
+def to_json(detection):
+	"""
+	Returns the dict sent back for a Detection, with null for
+	the values that are not finite.
+	"""
+	return {"box": [int(v) for v in detection.box], "params": [_finite(v) for v in detection.params],
+			"score": _finite(detection.score), "fallback": bool(detection.fallback),
+			"confidence": _finite(detection.confidence)}
+
+
+class DetectionHandler(BaseHTTPRequestHandler):
+	"""
+	HTTP requests of the daemon (the server has the batcher).
+	"""
+
+	def do_GET(self):
+		if self.path != "/health":
+			return self.reply(404, {"error": "Unknown path {}".format(self.path)})
+		batcher = self.server.batcher
+		self.reply(200, {"status": "ok", "batches": batcher.batches, "images": batcher.images,
+						 "max_batch": batcher.max_batch, "max_delay": batcher.max_delay})
+
+	def do_POST(self):
+		if self.path != "/detect":
+			return self.reply(404, {"error": "Unknown path {}".format(self.path)})
+		body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+		# Decode the images here, so it is done in parallel
+		if self.headers.get("Content-Type", "").startswith("application/json"):
+			try:
+				paths = json.loads(body.decode())["paths"]
+			except (ValueError, KeyError, TypeError):
+				return self.reply(400, {"error": "Expected a JSON body with the image paths"})
+			# None for the missing and undecodable files, so each
+			# one only fails its own result
+			images = [(path, cv2.imread(path, cv2.IMREAD_GRAYSCALE) if os.path.isfile(path) else None)
+					  for path in paths]
+		else:
+			image = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+			images = [(None, None if image is None else ut.convert_spaces(image, "BGR2GRAY"))]
+
+		futures = [(path, None if image is None else self.server.batcher.submit(image))
+				   for (path, image) in images]
+		results = []
+		for path, future in futures:
+			result = {"path": path} if path is not None else {}
+			try:
+				if future is None:
+					raise ValueError("Could not read the image")
+				result.update(to_json(future.result()))
+			except Exception as e:
+				result["error"] = str(e)
+			results.append(result)
+		self.reply(200, {"results": results})
+
+	def reply(self, code, content):
+		data = json.dumps(content, allow_nan=False).encode()
+		self.send_response(code)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		pass # No log line for every request
+
+
+class TCPDaemon(socketserver.ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+	request_queue_size = 128 # Lots of clients at the same time
+
+
+class UnixDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+	request_queue_size = 128
+
+	def get_request(self):
+		# BaseHTTPRequestHandler expects a (host, port) address
+		request, _ = socketserver.UnixStreamServer.get_request(self)
+		return request, ("local", 0)
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+	socket_path, port = arguments['--socket'], int(arguments['--port'])
+
+	# Everything is loaded once here
+	settings = {"N": 450, "window": (30, 30), "stride": 5,
+				"cast": not arguments['--no-cast'], "pyramid": arguments['--pyramid'],
+				"kmeans": arguments['--kmeans'], "threads": int(arguments['--threads'])}
+	detector = det.ODDetector.from_file(os.path.abspath(arguments['PCA']), **settings)
+	batcher = Batcher(detector, int(arguments['--max-batch']), float(arguments['--max-delay'])/1000)
+
+	if socket_path:
+		if os.path.exists(socket_path):
+			os.remove(socket_path) # Left by a previous daemon
+		server = UnixDaemon(socket_path, DetectionHandler)
+		address = socket_path
+	else:
+		server = TCPDaemon(("127.0.0.1", port), DetectionHandler)
+		address = "http://127.0.0.1:{:d}".format(port)
+	server.batcher = batcher
+
+	# Stop cleanly (socket removed) when terminated too
+	signal.signal(signal.SIGTERM, lambda signum, frame : sys.exit(0))
+
+	print(Fore.GREEN + "Listening on {} (Ctrl+C to stop)".format(address) + Style.RESET_ALL)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		detector.close()
+		if socket_path and os.path.exists(socket_path):
+			os.remove(socket_path)
@@ -0,0 +1,113 @@
+"""
+This file contains the (opt-in) stage timers of the
+OD pipeline. The code is wrapped in timer.stage(name)
+blocks, which do nothing when the timer is disabled,
+and the times of each image are collected with pop().
+A Summary gathers the times of all the images and
+reports the count, total, mean, p50, p95 and max of
+each stage.
+"""
+
+import time
+import numpy as np
+
+
+class _NullStage(object):
+	"""
+	Context manager that does nothing (disabled timer).
+	"""
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+	"""
+	Context manager adding its elapsed time to the timer.
+	"""
+	def __init__(self, times, name):
+		self.times, self.name = times, name
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		elapsed = time.perf_counter() - self.start
+		self.times[self.name] = self.times.get(self.name, 0.0) + elapsed
+		return False
+
+
+class Timer(object):
+	"""
+	Stage timer of one process. The times of the stages run
+	since the last pop() are added up (a stage can run more
+	than once per image).
+	"""
+
+	def __init__(self, enabled=False):
+		self.enabled = enabled
+		self.times = {}
+
+	def stage(self, name):
+		"""
+		Returns the context manager timing the stage name.
+		"""
+		if not self.enabled:
+			return _NULL_STAGE
+		return _Stage(self.times, name)
+
+	def pop(self):
+		"""
+		Returns the {stage: seconds} dict of the stages timed
+		since the last call, and starts a new one.
+		"""
+		times, self.times = self.times, {}
+		return times
+
+
+class Summary(object):
+	"""
+	Gathers the stage times of many images.
+	"""
+
+	def __init__(self):
+		self.stages = {}
+
+	def add(self, times):
+		"""
+		Adds the {stage: seconds} dict of one image.
+		"""
+		for name, seconds in times.items():
+			self.stages.setdefault(name, []).append(seconds)
+
+	def report(self):
+		"""
+		Returns a {stage: stats} dict, where stats has the count,
+		total (seconds) and the mean, p50, p95 and max (ms).
+		"""
+		report = {}
+		for name, values in self.stages.items():
+			values = np.array(values)
+			report[name] = {"count": len(values), "total": float(np.sum(values)),
+							"mean": 1000*float(np.mean(values)),
+							"p50": 1000*float(np.percentile(values, 50)),
+							"p95": 1000*float(np.percentile(values, 95)),
+							"max": 1000*float(np.max(values))}
+		return report
+
+	def table(self):
+		"""
+		Returns the report as a printable table (slowest first).
+		"""
+		report = self.report()
+		lines = ["{:<14} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+			"stage", "count", "total (s)", "mean (ms)", "p50 (ms)", "p95 (ms)", "max (ms)")]
+		for name, stats in sorted(report.items(), key=lambda item : -item[1]["total"]):
+			lines.append("{:<14} {count:>7d} {total:10.2f} {mean:10.2f} {p50:10.2f} {p95:10.2f} {max:10.2f}".format(
+				name, **stats))
+		return "\n".join(lines)
@@ -0,0 +1,166 @@
+""" Optic Disk Tracking
+
+This script will detect the OD along the frames of a
+fundus video (any file cv2.VideoCapture can open) or of a
+directory of frames (in name order). The full detection
+only runs on the keyframes, the other frames are searched
+around the previous disc (see detection.ODTracker). The
+boxes of all the frames are saved to a CSV file in the
+OUTPUT directory, and the per-frame latency is reported
+at the end (against the capture rate of the video).
+
+Usage:
+    track_od.py SOURCE OUTPUT PCA [options]
+
+Arguments:
+    SOURCE          Video file, or directory with the frames.
+    OUTPUT          The output directory to save the results.
+    PCA             The path to the PCA file.
+
+Options:
+    --keyframes=<n>     Max number of frames between two full
+                        detections [default: 30].
+    --search=<px>       Search radius around the previous disc, in
+                        pixels of the resized frame [default: 40].
+    --min-score=<r>     The track is lost (full detection) when the
+                        disc score drops below this fraction of the
+                        best one since the keyframe [default: 0.5].
+    --points=<m>        Points of the parabola fit on the keyframes,
+                        "pca" or "vessels" [default: pca].
+    --no-cast           Use the closed form TM_CCOEFF map.
+    --pyramid           Use the coarse to fine search.
+    --crops             Also save the OD crop of every frame.
+"""
+
+import files # For the file management stuff
+import os, sys, cv2, csv, time
+import utilities as ut
+import detection as det
+import numpy as np
+from colorama import Style, Fore, init # Colouring CLI stuff
+from docopt import docopt # CLI argument parser
+
+
+# Name of the results file (saved in the OUTPUT directory)
+RESULTS = "track_od_results.csv"
+RESULTS_HEADER = ["frame", "x1", "y1", "x2", "y2", "score", "keyframe", "fallback", "confidence"]
+
+
+def read_frames(source):
+	"""
+	This function will return a generator of the (name, frame)
+	of a video file or of the images of a directory (sorted
+	by name), the frames are BGR. The frame is None for the
+	images of the directory that can not be read.
+	"""
+	if os.path.isdir(source):
+		for path in sorted(files.get_images(source)):
+			yield files.get_filename(path), cv2.imread(path)
+		return
+
+	capture = cv2.VideoCapture(source)
+	try:
+		i = 0
+		while True:
+			ok, frame = capture.read()
+			if not ok:
+				break
+			yield "{:06d}".format(i), frame
+			i += 1
+	finally:
+		capture.release()
+
+
+def capture_rate(source):
+	"""
+	Returns the frame rate of a video file, None if unknown.
+	"""
+	if os.path.isdir(source):
+		return None
+	capture = cv2.VideoCapture(source)
+	rate = capture.get(cv2.CAP_PROP_FPS)
+	capture.release()
+	return rate if rate > 0 else None
+
+
+# Main program here
+if __name__== "__main__":
+
+	# init colourama to filter ANSI chars in windows/linux
+	init()
+
+	# Use __doc__ string to parse cmd arguments
+	arguments = docopt(Fore.RED + __doc__ + Style.RESET_ALL, version="1.0")
+
+	source = files.abspath(arguments['SOURCE'])
+	out_path = files.abspath(arguments['OUTPUT'])
+	if not os.path.lexists(source) or not os.path.isdir(out_path):
+		print(Fore.RED + "Path not found, the source or the output directory does not exist.")
+		print(Style.RESET_ALL)
+		sys.exit(0)
+
+	# Same detection settings as detect_od.py
+	settings = {"N": 450, "window": (30, 30), "stride": 5,
+				"cast": not arguments['--no-cast'], "pyramid": arguments['--pyramid'],
+				"points": arguments['--points']}
+	detector = det.ODDetector.from_file(files.abspath(arguments['PCA']), **settings)
+	tracker = det.ODTracker(detector, int(arguments['--keyframes']), int(arguments['--search']),
+							float(arguments['--min-score']))
+
+	rate = capture_rate(source)
+	print(Fore.BLUE + "Source................ %s" % source)
+	print("Capture rate.......... %s" % ("{:.1f} fps".format(rate) if rate else "unknown"))
+	print("Keyframes every....... %s frames" % arguments['--keyframes'] + Style.RESET_ALL)
+
+	latency = {True: [], False: []} # Keyframes and tracked frames
+	skipped = [] # Frames that could not be read
+	start = time.time()
+	with open(files.append_path(out_path, RESULTS), "w", newline="") as results_file:
+		results = csv.writer(results_file)
+		results.writerow(RESULTS_HEADER)
+		for name, frame in read_frames(source):
+			if frame is None:
+				print(Fore.RED + "\nCould not read the frame {}, skipped.".format(name) + Style.RESET_ALL)
+				skipped.append(name)
+				continue
+
+			frame_start = time.perf_counter()
+			detection, keyframe = tracker.update(frame)
+			latency[keyframe].append(1000*(time.perf_counter() - frame_start))
+
+			x1, y1, x2, y2 = detection.box
+			results.writerow([name, x1, y1, x2, y2, "{:.6g}".format(detection.score),
+							  int(keyframe), int(detection.fallback), "{:.3f}".format(detection.confidence)])
+			if arguments['--crops']:
+				od = frame[max(y1, 0):y2, max(x1, 0):x2]
+				if od.size:
+					cv2.imwrite(files.append_path(out_path, name + ".jpg"), od)
+
+			frames = len(latency[True]) + len(latency[False])
+			ut.update_line("Frame {:d} ({:.2f} frames/sec)".format(frames, frames/(time.time()-start)))
+
+	frames = len(latency[True]) + len(latency[False])
+	if not frames:
+		print(Fore.RED + "\nNo frames could be read from the source." + Style.RESET_ALL)
+		sys.exit(0)
+	print("\nFinished processing.")
+	if skipped:
+		print(Fore.RED + "Skipped {:d} frames that could not be read.".format(len(skipped)) + Style.RESET_ALL)
+
+	# Latency of the two kinds of frames
+	print(Fore.BLUE + "{:<10} {:>7} {:>10} {:>10} {:>10}".format("frames", "count", "p50 (ms)", "p95 (ms)", "max (ms)")
+		  + Style.RESET_ALL)
+	for keyframe, name in [(False, "tracked"), (True, "keyframes")]:
+		if latency[keyframe]:
+			values = latency[keyframe]
+			print("{:<10} {:7d} {:10.1f} {:10.1f} {:10.1f}".format(name, len(values), np.percentile(values, 50),
+				np.percentile(values, 95), np.max(values)))
+	print("Track lost............ {:d} times".format(tracker.lost))
+
+	# Can it keep up with the camera (on average)?
+	mean = np.mean(latency[True] + latency[False])
+	print("Mean latency.......... {:.1f} ms ({:.1f} frames/sec)".format(mean, 1000/mean))
+	if rate:
+		colour = Fore.GREEN if 1000/mean >= rate else Fore.RED
+		print(colour + "Capture rate {:.1f} fps, {}".format(rate, "keeping up" if 1000/mean >= rate else "falling behind")
+			  + Style.RESET_ALL)
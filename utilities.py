@@ -13,7 +13,7 @@ its being used a lot in multiple scripts.
 """
 # Version 0.1 - Python 3.x
 
-import cv2, sys, os
+import cv2, sys, os, struct
 import numpy as np
 import cv2
 import files 
@@ -51,6 +51,109 @@ def read_image(path:str, spaces:str="BGR2RGB") -> np.ndarray:
 
 	# Returns the converted image 
 	return convert_spaces(img, spaces)
+# OpenCV flags of the reduced grayscale decoders (the
+# JPEG decoder scales the DCT blocks, so it is cheap)
+reduced_flags = {
+				 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+				 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+				 8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+				}
+reduced_colour_flags = {
+				 2: cv2.IMREAD_REDUCED_COLOR_2,
+				 4: cv2.IMREAD_REDUCED_COLOR_4,
+				 8: cv2.IMREAD_REDUCED_COLOR_8,
+				}
+
+def image_size(path:str):
+	"""
+	This function will read the (height, width) of a JPEG
+	or PNG image from its header, without decoding it.
+
+	Args:
+		path - string representing the path of the image.
+
+	Returns:
+		(height, width) tuple, or None if the header could
+		not be read (unknown format or corrupt file).
+	"""
+	with open(path, "rb") as f:
+		head = f.read(24)
+
+		# PNG, the IHDR chunk is always first
+		if head[:8] == b"\x89PNG\r\n\x1a\n" and head[12:16] == b"IHDR":
+			width, height = struct.unpack(">II", head[16:24])
+			return (height, width)
+
+		# JPEG, walk the markers until the start of frame
+		if head[:2] != b"\xff\xd8":
+			return None
+		f.seek(2)
+		while True:
+			byte = f.read(1)
+			while byte == b"\xff": # Fill bytes
+				marker = f.read(1)
+				if marker != b"\xff":
+					break
+			else:
+				return None
+			if not marker or marker == b"\xd9": # End of image
+				return None
+			marker = marker[0]
+			if marker == 0x01 or 0xd0 <= marker <= 0xd8: # No length
+				continue
+			length = f.read(2)
+			if len(length) < 2:
+				return None
+			length = struct.unpack(">H", length)[0]
+
+			# SOF0-SOF15, except DHT, JPG and DAC
+			if 0xc0 <= marker <= 0xcf and marker not in (0xc4, 0xc8, 0xcc):
+				frame = f.read(5)
+				if len(frame) < 5:
+					return None
+				height, width = struct.unpack(">HH", frame[1:5])
+				return (height, width)
+			f.seek(length - 2, os.SEEK_CUR)
+
+def read_reduced(path:str, min_size:int, colour:bool=False):
+	"""
+	This function will load a grey image with OpenCV's
+	reduced size decoders. The factor (1, 2, 4 or 8) is the
+	largest one keeping both sides of the decoded image at
+	least min_size, and it is chosen from the image header.
+
+	Args:
+		path - string representing the path of the image.
+		min_size - int, minimum side of the decoded image.
+		colour - bool, load the BGR image instead.
+
+	Returns:
+		(image, original_size) tuple, where image is the grey
+		(or BGR) np array and original_size the (height, width)
+		of the full resolution image, (None, None) when the
+		image can not be read.
+	"""
+	size = image_size(path)
+	factor = 1
+	if size is not None:
+		for f in sorted(reduced_flags, reverse=True):
+			if min(size)//f >= min_size:
+				factor = f
+				break
+
+	if factor == 1:
+		img = cv2.imread(path, cv2.IMREAD_COLOR if colour else cv2.IMREAD_GRAYSCALE)
+		return (None, None) if img is None else (img, img.shape[0:2])
+	img = cv2.imread(path, (reduced_colour_flags if colour else reduced_flags)[factor])
+	if img is None:
+		return None, None
+
+	# imread applies the EXIF orientation, the header does not
+	height, width = size
+	if (img.shape[0] > img.shape[1]) != (height > width):
+		height, width = width, height
+	return img, (height, width)
+
 def save_image(filename:str, image:np.ndarray):
 	"""
 	Uses OpenCV to write an image to the disk. Make